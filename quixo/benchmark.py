@@ -0,0 +1,271 @@
+'''
+Benchmarks of the engine and of the players.
+
+Micro-benchmarks time single calls of the Game API (move, execute_move, check_winner,
+available_moves, possible_moves, get_board, ...) on a fixed set of positions from random games.
+Macro-benchmarks time the workloads of the players: random rollouts, minimax nodes, loading a
+Q-table and whole decisions of each player. The budget suite measures how much a time-limited
+MinMaxPlayer decision exceeds its limit: beyond --max-overrun milliseconds the exit status is 1.
+
+Every result is a rate (higher is better) or a time (lower is better). They can be written as JSON
+and compared with a baseline written by a previous run: a result worse than the baseline by more
+than the tolerance is a regression, and the exit status is 1.
+
+    python benchmark.py --out baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.15
+'''
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import bitboard
+import rollout
+from game import Game, decode_move
+from mcts import MCTS
+from players.impl import linearq, qtable
+from players.minmaxPlayer import MinMaxPlayer
+from players.montecarloPlayer import MonteCarloPlayer
+from players.qlearningPlayer import LinearQLearningPlayer, QLearningPlayer
+from players.randomPlayer import RandomPlayer
+
+
+def _positions(count: int, seed: int = 0) -> list[tuple[tuple[int, int], int]]:
+    '''Returns (bitboards, player to move) of positions from random games, none of them over'''
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        bitboards, player = (0, 0), 0
+        for _ in range(rng.randrange(60)):
+            move = rng.choice(bitboard.legal_moves(bitboards, player))
+            bitboards = bitboard.apply_move(bitboards, move, player)
+            player = 1 - player
+            if bitboard.winner(bitboards, player) != -1:
+                break
+        else:
+            positions.append((bitboards, player))
+    return positions
+
+
+def _game(bitboards: tuple[int, int], player: int) -> Game:
+    game = Game(showPrint=False)
+    game.set_position(bitboards, player)
+    return game
+
+
+def _rate(function, calls: int, min_time: float, rounds: int = 3) -> float:
+    '''
+    Calls function(i) for i in range(calls) until min_time / rounds seconds passed, rounds times.
+    Returns the calls per second of the fastest round, the least disturbed by the rest of the machine
+    '''
+    best = 0.0
+    for _ in range(rounds):
+        done = 0
+        start = time.perf_counter()
+        while True:
+            for i in range(calls):
+                function(i)
+            done += calls
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / rounds:
+                break
+        best = max(best, done / elapsed)
+    return best
+
+
+def micro(min_time: float) -> dict[str, tuple[float, str]]:
+    '''Calls per second of the Game API'''
+    positions = _positions(256)
+    games = [_game(b, p) for b, p in positions]
+    # one legal move of each position, in the formats of the API
+    moves = [random.Random(i).choice(bitboard.legal_moves(b, p)) for i, (b, p) in enumerate(positions)]
+    xy_moves = [decode_move(m) for m in moves]
+    row_col_moves = [((y, x), slide) for (x, y), slide in xy_moves]
+    n = len(positions)
+
+    def move(i):
+        game = games[i % n]
+        game.set_position(*positions[i % n])
+        game.move(row_col_moves[i % n][0], row_col_moves[i % n][1], positions[i % n][1])
+
+    def execute_move(i):
+        game = games[i % n]
+        game.set_position(*positions[i % n])
+        game.execute_move(xy_moves[i % n][0], xy_moves[i % n][1], positions[i % n][1])
+
+    def push_pop(i):
+        game = games[i % n]
+        game.push(moves[i % n])
+        game.pop()
+
+    for game, position in zip(games, positions):
+        game.set_position(*position)
+    results = {
+        'game.move': _rate(move, n, min_time),
+        'game.execute_move': _rate(execute_move, n, min_time),
+        'game.push_pop': _rate(push_pop, n, min_time),
+        'game.check_winner': _rate(lambda i: games[i % n].check_winner(), n, min_time),
+        'game.available_moves': _rate(lambda i: games[i % n].available_moves(positions[i % n][1]), n, min_time),
+        'game.possible_moves': _rate(lambda i: games[i % n].possible_moves(positions[i % n][1]), n, min_time),
+        'game.legal_moves': _rate(lambda i: games[i % n].legal_moves(positions[i % n][1]), n, min_time),
+        'game.get_board': _rate(lambda i: games[i % n].get_board(), n, min_time),
+        'bitboard.winner': _rate(lambda i: bitboard.winner(*positions[i % n]), n, min_time),
+        'bitboard.successors': _rate(lambda i: bitboard.successors(*positions[i % n]), n, min_time),
+    }
+    return {name: (value, 'calls/s') for name, value in results.items()}
+
+
+def _decisions(player, positions, min_time: float) -> float:
+    '''Decisions per second of the player on the positions'''
+    def decide(i):
+        bitboards, player_id = positions[i % len(positions)]
+        player.make_move(_game(bitboards, player_id))
+    return _rate(decide, len(positions), min_time)
+
+
+def macro(min_time: float) -> dict[str, tuple[float, str]]:
+    '''Rates of the workloads of the players, and the load time of a Q-table'''
+    results = {}
+    tree = MCTS(rng=random.Random(0))
+    results['rollouts.python'] = (_rate(lambda i: tree.rollout((0, 0), 0), 100, min_time), 'rollouts/s')
+    rng = np.random.default_rng(0)
+    results['rollouts.numpy'] = (_rate(lambda i: rollout.playouts((0, 0), 0, 4096, rng), 1, min_time) * 4096, 'rollouts/s')
+
+    positions = _positions(8, seed=1)
+    nodes = elapsed = 0
+    for bitboards, player_id in positions:
+        searcher = MinMaxPlayer(player_id, depth=3)
+        searcher.iterative_deepening(_game(bitboards, player_id))
+        nodes += searcher.search_info['nodes']
+        elapsed += searcher.search_info['time']
+    results['minmax.nodes'] = (nodes / elapsed, 'nodes/s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        # a table of 1M random pairs
+        table_rng = np.random.default_rng(0)
+        keys = np.unique(table_rng.integers(0, 1 << 56, 1 << 20, dtype=np.uint64))
+        table_path = os.path.join(directory, 'Q_table.bin')
+        qtable._write(table_path, keys, table_rng.random(len(keys), dtype=np.float32))
+        start = time.perf_counter()
+        table = qtable.QTableFile(table_path)
+        table.get(0, 0)
+        results['qtable.load'] = ((time.perf_counter() - start) * 1e3, 'ms')
+        results['qtable.get'] = (_rate(lambda i: table.get(i, i & 63), 1000, min_time), 'calls/s')
+
+        weights_path = os.path.join(directory, 'Q_linear.npy')
+        linearq.LinearQ().save(weights_path)
+        players = {
+            'random': RandomPlayer(),
+            'minmax': MinMaxPlayer(depth=2),
+            'montecarlo': MonteCarloPlayer(iterations=200, seed=0),
+            'qlearning': QLearningPlayer(0, table_path),
+            'qlinear': LinearQLearningPlayer(0, weights_path),
+        }
+        decision_positions = _positions(32, seed=2)
+        for name, player in players.items():
+            results[f'decisions.{name}'] = (_decisions(player, decision_positions, min_time), 'decisions/s')
+    return results
+
+
+def budget(min_time: float) -> dict[str, tuple[float, str]]:
+    '''
+    Longest time beyond the time_limit of the decisions of MinMaxPlayer, with and without the evaluator:
+    the search must notice that the budget is over while it scores its leaves in batches
+    '''
+    positions = _positions(16, seed=3)
+    results = {}
+    for evaluation in ('default', None):
+        for time_limit in (0.05, 0.2):
+            player = MinMaxPlayer(depth=8, time_limit=time_limit, evaluation=evaluation)
+            overrun = 0.0
+            for bitboards, player_id in positions:
+                start = time.perf_counter()
+                player.iterative_deepening(_game(bitboards, player_id))
+                overrun = max(overrun, time.perf_counter() - start - time_limit)
+            name = f"minmax.overrun.{evaluation or 'none'}.{time_limit:g}s"
+            results[name] = (overrun * 1e3, 'ms')
+    return results
+
+
+def overruns(report: dict, max_overrun: float) -> list[str]:
+    '''Returns the names of the budget results beyond max_overrun milliseconds'''
+    return [name for name, result in report['results'].items()
+            if name.startswith('budget.') and result['value'] > max_overrun]
+
+
+SUITES = {'micro': micro, 'macro': macro, 'budget': budget}
+
+
+def run(suites=('micro', 'macro', 'budget'), min_time: float = 0.5) -> dict:
+    '''Runs the suites, returns the report written as JSON: the environment and {name: {value, unit}}'''
+    results = {}
+    for suite in suites:
+        for name, (value, unit) in SUITES[suite](min_time).items():
+            results[f'{suite}.{name}'] = {'value': value, 'unit': unit}
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> list[dict]:
+    '''
+    Compares the results with the ones of the baseline. Returns one row per result in both:
+    name, value, baseline, change (positive is better) and regression (worse by more than tolerance)
+    '''
+    rows = []
+    for name, result in report['results'].items():
+        # the budget results are a few milliseconds of noise, bounded by --max-overrun instead
+        if name not in baseline['results'] or name.startswith('budget.'):
+            continue
+        old, new = baseline['results'][name]['value'], result['value']
+        if old == 0:
+            continue
+        change = new / old - 1
+        # times: lower is better
+        if result['unit'] in ('ms', 's'):
+            change = old / new - 1 if new else 0.0
+        rows.append({'name': name, 'value': new, 'baseline': old, 'unit': result['unit'],
+                     'change': change, 'regression': change < -tolerance})
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the Quixo engine and players')
+    parser.add_argument('--suite', choices=sorted(SUITES), nargs='+', default=['micro', 'macro', 'budget'])
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent on each benchmark')
+    parser.add_argument('--out', default=None, help='JSON file where the results are written')
+    parser.add_argument('--baseline', default=None, help='JSON file of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='slowdown allowed before a regression')
+    parser.add_argument('--max-overrun', type=float, default=25, help='milliseconds a decision may exceed its time limit')
+    args = parser.parse_args()
+
+    report = run(args.suite, args.min_time)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    late = overruns(report, args.max_overrun)
+    rows = []
+    if args.baseline is None:
+        for name, result in report['results'].items():
+            print(f"{name:<32} {result['value']:14.1f} {result['unit']}")
+    else:
+        with open(args.baseline) as f:
+            rows = compare(report, json.load(f), args.tolerance)
+        for row in rows:
+            flag = '  REGRESSION' if row['regression'] else ''
+            print(f"{row['name']:<32} {row['value']:14.1f} {row['unit']:<12} baseline {row['baseline']:14.1f}  "
+                  f"{row['change']:+7.1%}{flag}")
+    for name in late:
+        print(f'{name}: the time limit is exceeded by more than {args.max_overrun:g} ms')
+    sys.exit(1 if late or any(row['regression'] for row in rows) else 0)
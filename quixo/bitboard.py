@@ -0,0 +1,227 @@
+'''
+Bitboard representation of the Quixo board.
+
+Each player owns a 25-bit integer: bit (row * 5 + col) is set when the cube in that cell shows
+the player's symbol. A cell which is set in neither integer is neutral.
+All the masks and slide descriptions are precomputed once when the module is imported.
+'''
+
+SIZE = 5
+FULL = (1 << (SIZE * SIZE)) - 1
+
+# slide directions, same values as game.Move
+TOP = 0
+BOTTOM = 1
+LEFT = 2
+RIGHT = 3
+
+
+def bit(row: int, col: int) -> int:
+    '''Returns the mask of a single cell'''
+    return 1 << (row * SIZE + col)
+
+
+ROW_MASKS = [sum(bit(r, c) for c in range(SIZE)) for r in range(SIZE)]
+COL_MASKS = [sum(bit(r, c) for r in range(SIZE)) for c in range(SIZE)]
+DIAG_MASK = sum(bit(i, i) for i in range(SIZE))
+ANTI_DIAG_MASK = sum(bit(i, SIZE - 1 - i) for i in range(SIZE))
+# rows, columns, principal and secondary diagonal
+LINE_MASKS = ROW_MASKS + COL_MASKS + [DIAG_MASK, ANTI_DIAG_MASK]
+
+EDGE_MASK = ROW_MASKS[0] | ROW_MASKS[-1] | COL_MASKS[0] | COL_MASKS[-1]
+
+
+def _slide_spec(row: int, col: int, slide: int) -> tuple[int, int, int, int, int] | None:
+    '''
+    Describes a slide as (keep, src, lshift, rshift, dest):
+    - keep: cells which are not touched by the slide
+    - src: cells which are shifted by one position
+    - lshift/rshift: how much src is shifted (only one of them is non zero)
+    - dest: cell where the taken cube is placed
+    Returns None if the slide is not allowed from (row, col).
+    '''
+    if not bit(row, col) & EDGE_MASK:
+        return None
+    last = SIZE - 1
+    if slide == LEFT and col > 0:
+        # cells on the left of the piece move one column to the right
+        src = sum(bit(row, c) for c in range(col))
+        return FULL ^ (src | bit(row, col)), src, 1, 0, bit(row, 0)
+    if slide == RIGHT and col < last:
+        # cells on the right of the piece move one column to the left
+        src = sum(bit(row, c) for c in range(col + 1, SIZE))
+        return FULL ^ (src | bit(row, col)), src, 0, 1, bit(row, last)
+    if slide == TOP and row > 0:
+        # cells above the piece move one row down
+        src = sum(bit(r, col) for r in range(row))
+        return FULL ^ (src | bit(row, col)), src, SIZE, 0, bit(0, col)
+    if slide == BOTTOM and row < last:
+        # cells below the piece move one row up
+        src = sum(bit(r, col) for r in range(row + 1, SIZE))
+        return FULL ^ (src | bit(row, col)), src, 0, SIZE, bit(last, col)
+    return None
+
+
+# SLIDES[row][col][slide] -> slide description or None
+SLIDES = [[[_slide_spec(r, c, s) for s in range(4)] for c in range(SIZE)] for r in range(SIZE)]
+
+# Move ids: every geometrically valid (row, col, slide), cells in row-major order.
+# There are 44 of them: 3 slides for each of the 12 side cells and 2 for each corner.
+MOVES = [(r, c, s) for r in range(SIZE) for c in range(SIZE) for s in range(4) if SLIDES[r][c][s] is not None]
+NUM_MOVES = len(MOVES)
+MOVE_SPECS = [SLIDES[r][c][s] for r, c, s in MOVES]
+# MOVE_IDS[row][col][slide] -> move id or None
+MOVE_IDS = [[[None] * 4 for _ in range(SIZE)] for _ in range(SIZE)]
+for _id, (_r, _c, _s) in enumerate(MOVES):
+    MOVE_IDS[_r][_c][_s] = _id
+del _id, _r, _c, _s
+# cell taken by each move
+MOVE_CELLS = [bit(r, c) for r, c, _ in MOVES]
+
+# MOVE_LINES[move id] -> masks of the lines through the cells changed by the move: the slid segment
+MOVE_LINES = [tuple(mask for mask in LINE_MASKS if mask & ~spec[0] & FULL) for spec in MOVE_SPECS]
+# ROW_MOVES[row][bits] -> ids of the moves which take one of the cells set in the 5 bits of the row
+ROW_MOVES = [
+    [tuple(i for i, (r, c, _) in enumerate(MOVES) if r == row and bits >> c & 1) for bits in range(1 << SIZE)]
+    for row in range(SIZE)
+]
+
+
+_CELLS = SIZE * SIZE
+
+# The 8 symmetries of the square (rotations and reflections) as maps (row, col) -> (row, col)
+_LAST = SIZE - 1
+_SYMMETRY_MAPS = [
+    lambda r, c: (r, c),                  # identity
+    lambda r, c: (c, _LAST - r),          # rotation by 90 degrees
+    lambda r, c: (_LAST - r, _LAST - c),  # rotation by 180 degrees
+    lambda r, c: (_LAST - c, r),          # rotation by 270 degrees
+    lambda r, c: (r, _LAST - c),          # horizontal mirror
+    lambda r, c: (_LAST - r, c),          # vertical mirror
+    lambda r, c: (c, r),                  # principal diagonal
+    lambda r, c: (_LAST - c, _LAST - r),  # secondary diagonal
+]
+NUM_SYMMETRIES = len(_SYMMETRY_MAPS)
+# CELL_SYMMETRIES[s][cell index] -> index of the cell where symmetry s sends it
+CELL_SYMMETRIES = [
+    [f(i // SIZE, i % SIZE)[0] * SIZE + f(i // SIZE, i % SIZE)[1] for i in range(SIZE * SIZE)] for f in _SYMMETRY_MAPS
+]
+# INVERSE_SYMMETRIES[s] -> symmetry which undoes s
+INVERSE_SYMMETRIES = [
+    next(t for t in range(NUM_SYMMETRIES) if all(CELL_SYMMETRIES[t][CELL_SYMMETRIES[s][i]] == i for i in range(SIZE * SIZE)))
+    for s in range(NUM_SYMMETRIES)
+]
+
+
+def _move_symmetry(f, move_id: int) -> int:
+    '''Returns the id of move_id transformed by the symmetry f'''
+    row, col, slide = MOVES[move_id]
+    # the taken cube ends on the border, at the end of its line
+    dest = {TOP: (0, col), BOTTOM: (_LAST, col), LEFT: (row, 0), RIGHT: (row, _LAST)}[slide]
+    (r, c), (dr, dc) = f(row, col), f(*dest)
+    if dc == c:
+        return MOVE_IDS[r][c][TOP if dr < r else BOTTOM]
+    return MOVE_IDS[r][c][LEFT if dc < c else RIGHT]
+
+
+# MOVE_SYMMETRIES[s][move id] -> id of the same move on the board transformed by symmetry s
+MOVE_SYMMETRIES = [[_move_symmetry(f, m) for m in range(NUM_MOVES)] for f in _SYMMETRY_MAPS]
+# ROW_SYMMETRIES[s][row][bits] -> cells where symmetry s sends the cells set in the 5 bits of the row
+ROW_SYMMETRIES = [
+    [[sum(1 << cells[row * SIZE + c] for c in range(SIZE) if bits >> c & 1) for bits in range(1 << SIZE)] for row in range(SIZE)]
+    for cells in CELL_SYMMETRIES
+]
+
+def legal_moves(bitboards: tuple[int, int], player_id: int) -> tuple[int, ...]:
+    '''Returns the ids of the moves that player_id can perform, in increasing order'''
+    # a cube can be taken if it does not belong to the opponent
+    free = FULL ^ bitboards[1 - player_id]
+    r0, r1, r2, r3, r4 = ROW_MOVES
+    return r0[free & 31] + r1[free >> 5 & 31] + r2[free >> 10 & 31] + r3[free >> 15 & 31] + r4[free >> 20]
+
+
+def apply_move(bitboards: tuple[int, int], move_id: int, player_id: int) -> tuple[int, int]:
+    '''Returns the bitboards after player_id performed move_id. The move is not checked'''
+    keep, src, lshift, rshift, dest = MOVE_SPECS[move_id]
+    b0, b1 = bitboards
+    b0 = (b0 & keep) | (((b0 & src) << lshift) >> rshift)
+    b1 = (b1 & keep) | (((b1 & src) << lshift) >> rshift)
+    # the taken piece always shows the symbol of the player
+    if player_id:
+        return b0, b1 | dest
+    return b0 | dest, b1
+
+
+def transform(board: int, symmetry: int) -> int:
+    '''Returns the bitboard of one player moved by symmetry (an index of CELL_SYMMETRIES)'''
+    r0, r1, r2, r3, r4 = ROW_SYMMETRIES[symmetry]
+    return r0[board & 31] | r1[board >> 5 & 31] | r2[board >> 10 & 31] | r3[board >> 15 & 31] | r4[board >> 20]
+
+
+def canonical(bitboards: tuple[int, int]) -> tuple[int, int]:
+    '''
+    Returns (code, symmetry) of the rotation/reflection of the position with the smallest code
+    b0 | b1 << 25, i.e. the lexicographically smallest board. Positions which are symmetric to
+    each other have the same code
+    '''
+    b0, b1 = bitboards
+    best, best_symmetry = b0 | b1 << _CELLS, 0
+    for symmetry in range(1, NUM_SYMMETRIES):
+        code = transform(b0, symmetry) | transform(b1, symmetry) << _CELLS
+        if code < best:
+            best, best_symmetry = code, symmetry
+    return best, best_symmetry
+
+
+def successors(bitboards: tuple[int, int], player_id: int, symmetric: bool = False) -> list[tuple[int, tuple[int, int]]]:
+    '''
+    Returns (move id, position reached) for each distinct position that player_id can reach, with
+    the smallest move id which reaches it: taking a neutral or an own cube, or sliding a uniform line,
+    often gives the same board. With symmetric the positions which are rotations or reflections of
+    each other count once too (they have the same value)
+    '''
+    children = {}
+    for move_id in legal_moves(bitboards, player_id):
+        child = apply_move(bitboards, move_id, player_id)
+        key = canonical(child)[0] if symmetric else child
+        if key not in children:
+            children[key] = (move_id, child)
+    return list(children.values())
+
+
+def unique_moves(bitboards: tuple[int, int], player_id: int, symmetric: bool = False) -> list[int]:
+    '''Returns the move ids of successors'''
+    return [move_id for move_id, _ in successors(bitboards, player_id, symmetric)]
+
+
+def winner(bitboards: tuple[int, int], player_id: int) -> int:
+    '''
+    Returns the winner of the position with player_id to move, -1 if there is none.
+    A move which completes a line for both players loses (Quixo rules): then the winner is player_id
+    '''
+    board = bitboards[player_id]
+    for mask in LINE_MASKS:
+        if board & mask == mask:
+            return player_id
+    board = bitboards[1 - player_id]
+    for mask in LINE_MASKS:
+        if board & mask == mask:
+            return 1 - player_id
+    return -1
+
+
+def winner_after(bitboards: tuple[int, int], move_id: int, player_id: int) -> int:
+    '''
+    Same as winner for the position reached with move_id, player_id to move after it. The position
+    before the move must have no winner: only the lines through the cells changed by the move are checked
+    '''
+    masks = MOVE_LINES[move_id]
+    board = bitboards[player_id]
+    for mask in masks:
+        if board & mask == mask:
+            return player_id
+    board = bitboards[1 - player_id]
+    for mask in masks:
+        if board & mask == mask:
+            return 1 - player_id
+    return -1
@@ -0,0 +1,151 @@
+'''
+Heuristic evaluation of the positions for the search players.
+
+A position is scored from the point of view of a player with a weighted sum of features, each
+one the difference between the player and the opponent:
+
+    line2, line3, line4  lines with 2, 3, 4 pieces of the player and none of the opponent
+    center               the center cell
+    inner                the 8 cells around the center
+    edge                 the 16 border cells (the cubes the player can take)
+    threat               +1 if the player to move has a line with 4 pieces and none of the opponent's,
+                         from the point of view of the player (so -1 if it is the opponent)
+
+The sum s is squashed to s / (1 + |s|), strictly between -1 and 1: a win (+1) or a loss (-1)
+always counts more than any position. Many positions, e.g. all the children of a node, are
+scored with one batch of array operations.
+
+The weights are a dict; the configs of WEIGHT_CONFIGS or a JSON file can be used. Run the module
+to fit the weights to the results of random games (logistic regression) and write them:
+    python evaluation.py --games 5000 --out weights.json
+'''
+import argparse
+import json
+
+import numpy as np
+
+import bitboard
+import rollout
+
+FEATURES = ('line2', 'line3', 'line4', 'center', 'inner', 'edge', 'threat')
+
+WEIGHT_CONFIGS = {
+    'default': {'line2': 0.05, 'line3': 0.2, 'line4': 0.6, 'center': 0.1, 'inner': 0.03, 'edge': 0.02, 'threat': 1.0},
+    # lines first
+    'attack': {'line2': 0.1, 'line3': 0.4, 'line4': 1.0, 'center': 0.05, 'inner': 0.02, 'edge': 0.0, 'threat': 0.8},
+    # the threats of the opponent and the control of the board
+    'defense': {'line2': 0.03, 'line3': 0.15, 'line4': 0.5, 'center': 0.2, 'inner': 0.05, 'edge': 0.05, 'threat': 1.5},
+}
+
+_CELL_BITS = np.arange(bitboard.SIZE * bitboard.SIZE, dtype=np.int64)
+# _LINE_MATRIX[cell, line] = 1 if the line goes through the cell
+_LINE_MATRIX = np.array(
+    [[mask >> cell & 1 for mask in bitboard.LINE_MASKS] for cell in _CELL_BITS.tolist()], dtype=np.float32
+)
+_CENTER = bitboard.SIZE // 2
+_INNER = [cell for cell in _CELL_BITS.tolist()
+          if max(abs(cell // bitboard.SIZE - _CENTER), abs(cell % bitboard.SIZE - _CENTER)) == 1]
+_EDGE = [cell for cell in _CELL_BITS.tolist() if bitboard.EDGE_MASK >> cell & 1]
+# _REGION_MATRIX[cell] -> (center, inner, edge)
+_REGION_MATRIX = np.zeros((len(_CELL_BITS), 3), dtype=np.float32)
+_REGION_MATRIX[_CENTER * bitboard.SIZE + _CENTER, 0] = 1
+_REGION_MATRIX[_INNER, 1] = 1
+_REGION_MATRIX[_EDGE, 2] = 1
+
+
+def features(b0: np.ndarray, b1: np.ndarray, player_id: int, to_move: np.ndarray) -> np.ndarray:
+    '''Returns the (N, len(FEATURES)) features of N positions from the point of view of player_id'''
+    mine, theirs = (b0, b1) if player_id == 0 else (b1, b0)
+    m = ((mine[:, None] >> _CELL_BITS) & 1).astype(np.float32)
+    t = ((theirs[:, None] >> _CELL_BITS) & 1).astype(np.float32)
+    m_lines = m @ _LINE_MATRIX
+    t_lines = t @ _LINE_MATRIX
+    m_open = np.where(t_lines == 0, m_lines, 0)
+    t_open = np.where(m_lines == 0, t_lines, 0)
+    lines = [(m_open == k).sum(axis=1) - (t_open == k).sum(axis=1) for k in (2, 3, 4)]
+    regions = m @ _REGION_MATRIX - t @ _REGION_MATRIX
+    m_threat = (m_open == 4).any(axis=1)
+    t_threat = (t_open == 4).any(axis=1)
+    threat = np.where(to_move == player_id, m_threat, 0) - np.where(to_move == player_id, 0, t_threat)
+    return np.column_stack(lines + [regions, threat]).astype(np.float32)
+
+
+class Evaluator:
+    def __init__(self, weights: str | dict = 'default') -> None:
+        '''weights: a dict {feature: weight}, the name of a config of WEIGHT_CONFIGS or the path of a JSON file'''
+        if isinstance(weights, str):
+            if weights in WEIGHT_CONFIGS:
+                weights = WEIGHT_CONFIGS[weights]
+            else:
+                with open(weights) as f:
+                    weights = json.load(f)
+        unknown = set(weights) - set(FEATURES)
+        if unknown:
+            raise ValueError(f'unknown features {sorted(unknown)}, expected some of {FEATURES}')
+        self.weights = {name: float(weights.get(name, 0.0)) for name in FEATURES}
+        self._vector = np.array([self.weights[name] for name in FEATURES], dtype=np.float32)
+
+    def evaluate_batch(self, b0: np.ndarray, b1: np.ndarray, player_id: int, to_move) -> np.ndarray:
+        '''Returns the scores in (-1, 1) of the positions for player_id. to_move: player to move, one or one per position'''
+        to_move = np.broadcast_to(np.asarray(to_move), len(b0))
+        score = features(b0, b1, player_id, to_move) @ self._vector
+        return score / (1 + np.abs(score))
+
+    def evaluate(self, bitboards: tuple[int, int], player_id: int, to_move: int) -> float:
+        '''Returns the score in (-1, 1) of the position for player_id'''
+        b0 = np.array([bitboards[0]], dtype=np.int64)
+        b1 = np.array([bitboards[1]], dtype=np.int64)
+        return float(self.evaluate_batch(b0, b1, player_id, to_move)[0])
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.weights, f, indent=2)
+
+
+def fit(games: int = 5000, max_plies: int = 100, epochs: int = 500, learning_rate: float = 0.5,
+        seed: int = 0) -> dict[str, float]:
+    '''
+    Fits the weights to random games: every position of a game is labelled with its result for
+    player 0, and the weights of a logistic regression of the result on the features are returned
+    '''
+    rng = np.random.default_rng(seed)
+    b0 = np.zeros(games, dtype=np.int64)
+    b1 = np.zeros(games, dtype=np.int64)
+    player = np.zeros(games, dtype=np.int64)
+    positions = []
+    result = np.full(games, -1, dtype=np.int64)
+    active = np.arange(games)
+    for _ in range(max_plies):
+        keys = rng.random((len(active), bitboard.NUM_MOVES))
+        keys[~rollout.legal_mask(b0, b1, player)] = -1.0
+        b0, b1 = rollout.apply_moves(b0, b1, player, keys.argmax(axis=1))
+        player = 1 - player
+        w = rollout.winners(b0, b1, player)
+        positions.append((active, features(b0, b1, 0, player)))
+        done = w != -1
+        result[active[done]] = w[done]
+        active, b0, b1, player = active[~done], b0[~done], b1[~done], player[~done]
+        if len(active) == 0:
+            break
+    x = np.concatenate([phi for game, phi in positions])
+    game = np.concatenate([game for game, phi in positions])
+    # positions of the games without a winner are not used
+    decided = result[game] != -1
+    x, y = x[decided], (result[game][decided] == 0).astype(np.float32)
+    weights = np.zeros(len(FEATURES), dtype=np.float32)
+    for _ in range(epochs):
+        p = 1 / (1 + np.exp(-(x @ weights)))
+        weights -= learning_rate * x.T @ (p - y) / len(y)
+    return {name: float(w) for name, w in zip(FEATURES, weights)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit the weights of the evaluation to random games')
+    parser.add_argument('--games', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='weights.json')
+    args = parser.parse_args()
+
+    weights = fit(args.games, seed=args.seed)
+    Evaluator(weights).save(args.out)
+    print(json.dumps(weights, indent=2))
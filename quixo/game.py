@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
-from copy import deepcopy
 from enum import Enum
+import time
 import numpy as np
 
+import bitboard
+import observers as observers_module
+
 # Rules on PDF
 
 
@@ -35,24 +38,43 @@ class Player(ABC):
 
 class Game(object):
     def __init__(self,showPrint: bool = True) -> None:
-        self._board = np.ones((5, 5), dtype=np.uint8) * -1
+        # one 25-bit integer per player, see bitboard.py
+        self._bitboards = (0, 0)
         self.current_player_idx = 1
         self.showPrint = showPrint
         self.num_playes=0
+        # one packed record per pushed move, see push/pop
+        self._undo = []
+        # winner of the position, updated by every move so that check_winner costs nothing
+        self._winner = -1
+
 
-        
+
+    @property
+    def _board(self) -> np.ndarray:
+        '''5x5 array built from the bitboards: -1 neutral, 0 and 1 the players'''
+        b0, b1 = self._bitboards
+        board = ((b0 >> _CELL_SHIFTS) & 1) + 2 * ((b1 >> _CELL_SHIFTS) & 1) - 1
+        return board.astype(np.int16).reshape(bitboard.SIZE, bitboard.SIZE)
 
     def get_board(self) -> np.ndarray:
         '''
         Returns the board
         '''
-        return deepcopy(self._board)
+        return self._board
 
     def get_current_player(self) -> int:
         '''
         Returns the current player
         '''
-        return deepcopy(self.current_player_idx)
+        return self.current_player_idx
+
+    def set_position(self, bitboards: tuple[int, int], player_id: int) -> None:
+        '''Sets the board and the player to move, e.g. a position to search. The moves pushed before are forgotten'''
+        self._bitboards = bitboards
+        self.current_player_idx = player_id
+        self._winner = bitboard.winner(bitboards, player_id)
+        self._undo = []
 
     def print(self):
          if self.showPrint:
@@ -76,43 +98,26 @@ class Game(object):
                 print()
             print()
 
-      
+
     def check_winner(self) -> int:
         '''Check the winner. Returns the player ID of the winner if any, otherwise returns -1'''
-        # for each row
-        for x in range(self._board.shape[0]):
-            # if a player has completed an entire row
-            if self._board[x, 0] != -1 and all(self._board[x, :] == self._board[x, 0]):
-                # return the relative id
-                return self._board[x, 0]
-        # for each column
-        for y in range(self._board.shape[1]):
-            # if a player has completed an entire column
-            if self._board[0, y] != -1 and all(self._board[:, y] == self._board[0, y]):
-                # return the relative id
-                return self._board[0, y]
-        # if a player has completed the principal diagonal
-        if self._board[0, 0] != -1 and all(
-            [self._board[x, x]
-                for x in range(self._board.shape[0])] == self._board[0, 0]
-        ):
-            # return the relative id
-            return self._board[0, 0]
-        # if a player has completed the secondary diagonal
-        if self._board[0, -1] != -1 and all(
-            [self._board[x, -(x + 1)]
-             for x in range(self._board.shape[0])] == self._board[0, -1]
-        ):
-            # return the relative id
-            return self._board[0, -1]
-        return -1
-    
-    
-    def play(self, player1: Player, player2: Player) -> int:
-        '''Play the game. Returns the winning player'''
+        return self._winner
+
+
+    def play(self, player1: Player, player2: Player, max_turns: int | None = None, observers: list | None = None) -> int:
+        '''
+        Play the game. Returns the winning player, -1 (draw) if nobody won within max_turns turns.
+        observers receive an event for every turn, see observers.py
+        '''
+        if observers:
+            return self.__play_observed(player1, player2, max_turns, observers)
         players = [player1, player2]
         winner = -1
+        turns = 0
         while winner < 0:
+            if max_turns is not None and turns >= max_turns:
+                break
+            turns += 1
             self.current_player_idx += 1
             self.current_player_idx %= len(players)
             ok = False
@@ -121,212 +126,155 @@ class Game(object):
                 from_pos, slide = players[self.current_player_idx].make_move(self)
                 ok = self.__move(from_pos, slide, self.current_player_idx)
                 attempts += 1
-                
+            if ok:
+                self.num_playes += 1
+
+            winner = self.check_winner()
+        return winner
+
+    def __play_observed(self, player1: Player, player2: Player, max_turns: int | None, observers: list) -> int:
+        '''The loop of play, timing every make_move and counting the rejected attempts'''
+        players = [player1, player2]
+        # the last observers see the move first, so that the profiler of the move stops before the others run
+        reverse = observers[::-1]
+        for observer in observers:
+            observer.game_start(self, players)
+        winner = -1
+        turns = 0
+        while winner < 0:
+            if max_turns is not None and turns >= max_turns:
+                break
+            turns += 1
+            self.current_player_idx += 1
+            self.current_player_idx %= len(players)
+            player_id = self.current_player_idx
+            player = players[player_id]
+            for observer in observers:
+                observer.before_move(self, turns, player_id)
+            ok = False
+            attempts = 0
+            elapsed = 0.0
+            while not ok and attempts < 10:
+                start = time.perf_counter()
+                from_pos, slide = player.make_move(self)
+                elapsed += time.perf_counter() - start
+                ok = self.__move(from_pos, slide, player_id)
+                attempts += 1
+            if ok:
+                self.num_playes += 1
+            event = {
+                'ply': turns,
+                'player': player_id,
+                'move': encode_move(from_pos, slide) if ok else -1,
+                'time': elapsed,
+                'rejected': attempts - ok,
+                'board_hash': observers_module.board_hash(self._bitboards),
+                'info': observers_module.agent_info(player),
+            }
+            for observer in reverse:
+                observer.after_move(event)
             winner = self.check_winner()
+        for observer in reverse:
+            observer.game_end(self, winner)
         return winner
 
 
 
-    
-    
+
+
 
     def __move(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool:
         '''Perform a move'''
-        if player_id > 2:
-            return False
-        # Oh God, Numpy arrays
-        
-        prev_value = deepcopy(self._board[(from_pos[1], from_pos[0])])
-
-        acceptable = self.__take((from_pos[1], from_pos[0]), player_id)
-        if acceptable:
-            acceptable = self.__slide((from_pos[1], from_pos[0]), slide)
-            if not acceptable:
-                self._board[(from_pos[1], from_pos[0])] = deepcopy(prev_value)
-        return acceptable
-    
+        return self.__take_and_slide((from_pos[1], from_pos[0]), slide, player_id)
+
 
     def move(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool:
         '''Perform a move'''
-
-        if player_id > 2:
+        if player_id not in (0, 1):
             return False
-        
+
         self.num_playes+=1
 
-        prev_value = deepcopy(self._board[(from_pos[0], from_pos[1])])
-        acceptable = self.__take((from_pos[0], from_pos[1]), player_id)
-        if acceptable:
-            acceptable = self.__slide((from_pos[0], from_pos[1]), slide)
-            if not acceptable:
-                self._board[(from_pos[0], from_pos[1])] = deepcopy(prev_value)
-        return acceptable
-
-    def __take(self, from_pos: tuple[int, int], player_id: int) -> bool:
-        '''Take piece'''
-        # acceptable only if in border
-        acceptable: bool = (
-            # check if it is in the first row
-            (from_pos[0] == 0 and from_pos[1] < 5)
-            # check if it is in the last row
-            or (from_pos[0] == 4 and from_pos[1] < 5)
-            # check if it is in the first column
-            or (from_pos[1] == 0 and from_pos[0] < 5)
-            # check if it is in the last column
-            or (from_pos[1] == 4 and from_pos[0] < 5)
-            # and check if the piece can be moved by the current player
-        ) and (self._board[from_pos] < 0 or self._board[from_pos] == player_id)
-        if acceptable:
-            self._board[from_pos] = player_id
-        return acceptable
-
-    def __slide(self, from_pos: tuple[int, int], slide: Move) -> bool:
-        '''Slide the other pieces'''
-        # define the corners
-        SIDES = [(0, 0), (0, 4), (4, 0), (4, 4)]
-        # if the piece position is not in a corner
-        if from_pos not in SIDES:
-            # if it is at the TOP, it can be moved down, left or right
-            acceptable_top: bool = from_pos[0] == 0 and (
-                slide == Move.BOTTOM or slide == Move.LEFT or slide == Move.RIGHT
-            )
-            # if it is at the BOTTOM, it can be moved up, left or right
-            acceptable_bottom: bool = from_pos[0] == 4 and (
-                slide == Move.TOP or slide == Move.LEFT or slide == Move.RIGHT
-            )
-            # if it is on the LEFT, it can be moved up, down or right
-            acceptable_left: bool = from_pos[1] == 0 and (
-                slide == Move.BOTTOM or slide == Move.TOP or slide == Move.RIGHT
-            )
-            # if it is on the RIGHT, it can be moved up, down or left
-            acceptable_right: bool = from_pos[1] == 4 and (
-                slide == Move.BOTTOM or slide == Move.TOP or slide == Move.LEFT
-            )
-        # if the piece position is in a corner
+        return self.__take_and_slide((from_pos[0], from_pos[1]), slide, player_id)
+
+    def __take_and_slide(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool:
+        '''Take the piece in (row, col) and slide it. The board is left untouched if the move is not acceptable'''
+        move_id = self.__move_id(from_pos, slide, player_id)
+        if move_id is None:
+            return False
+        self.__update(move_id, player_id)
+        return True
+
+    def __move_id(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> int | None:
+        '''Returns the id of the move from (row, col) if the player can perform it, otherwise None'''
+        if player_id != 0 and player_id != 1:
+            return None
+        row, col = from_pos
+        if row < 0 or row >= bitboard.SIZE or col < 0 or col >= bitboard.SIZE:
+            return None
+        # the piece can be taken only if it is neutral or already belongs to the player
+        if self._bitboards[1 - player_id] >> (row * bitboard.SIZE + col) & 1:
+            return None
+        # None if the piece is not on the border or the slide is not allowed from there
+        # _value_ is the plain attribute behind Move.value, much cheaper on this hot path
+        return bitboard.MOVE_IDS[row][col][slide._value_]
+
+    def __update(self, move_id: int, player_id: int) -> None:
+        '''Applies the move and updates the winner, checking only the lines the move changed'''
+        self._bitboards = bitboard.apply_move(self._bitboards, move_id, player_id)
+        if self._winner == -1:
+            self._winner = bitboard.winner_after(self._bitboards, move_id, 1 - player_id)
         else:
-            # if it is in the upper left corner, it can be moved to the right and down
-            acceptable_top: bool = from_pos == (0, 0) and (
-                slide == Move.BOTTOM or slide == Move.RIGHT)
-            # if it is in the lower left corner, it can be moved to the right and up
-            acceptable_left: bool = from_pos == (4, 0) and (
-                slide == Move.TOP or slide == Move.RIGHT)
-            # if it is in the upper right corner, it can be moved to the left and down
-            acceptable_right: bool = from_pos == (0, 4) and (
-                slide == Move.BOTTOM or slide == Move.LEFT)
-            # if it is in the lower right corner, it can be moved to the left and up
-            acceptable_bottom: bool = from_pos == (4, 4) and (
-                slide == Move.TOP or slide == Move.LEFT)
-        # check if the move is acceptable
-        acceptable: bool = acceptable_top or acceptable_bottom or acceptable_left or acceptable_right
-        # if it is
-        if acceptable:
-            # take the piece
-            piece = self._board[from_pos]
-            # if the player wants to slide it to the left
-            if slide == Move.LEFT:
-                # for each column starting from the column of the piece and moving to the left
-                for i in range(from_pos[1], 0, -1):
-                    # copy the value contained in the same row and the previous column
-                    self._board[(from_pos[0], i)] = self._board[(
-                        from_pos[0], i - 1)]
-                # move the piece to the left
-                self._board[(from_pos[0], 0)] = piece
-            # if the player wants to slide it to the right
-            elif slide == Move.RIGHT:
-                # for each column starting from the column of the piece and moving to the right
-                for i in range(from_pos[1], self._board.shape[1] - 1, 1):
-                    # copy the value contained in the same row and the following column
-                    self._board[(from_pos[0], i)] = self._board[(
-                        from_pos[0], i + 1)]
-                # move the piece to the right
-                self._board[(from_pos[0], self._board.shape[1] - 1)] = piece
-            # if the player wants to slide it upward
-            elif slide == Move.TOP:
-                # for each row starting from the row of the piece and going upward
-                for i in range(from_pos[0], 0, -1):
-                    # copy the value contained in the same column and the previous row
-                    self._board[(i, from_pos[1])] = self._board[(
-                        i - 1, from_pos[1])]
-                # move the piece up
-                self._board[(0, from_pos[1])] = piece
-            # if the player wants to slide it downward
-            elif slide == Move.BOTTOM:
-                # for each row starting from the row of the piece and going downward
-                for i in range(from_pos[0], self._board.shape[0] - 1, 1):
-                    # copy the value contained in the same column and the following row
-                    self._board[(i, from_pos[1])] = self._board[(
-                        i + 1, from_pos[1])]
-                # move the piece down
-                self._board[(self._board.shape[0] - 1, from_pos[1])] = piece
-        return acceptable
-    
+            # moves played after the end of the game
+            self._winner = bitboard.winner(self._bitboards, 1 - player_id)
 
+    def legal_moves(self, player_id: int) -> tuple[int, ...]:
+        '''Returns the ids of the moves the player can perform, see bitboard.MOVES'''
+        return bitboard.legal_moves(self._bitboards, player_id)
 
+    def apply_move(self, move_id: int, player_id: int) -> None:
+        '''Performs a move id returned by legal_moves. The move is not checked'''
+        self.__update(move_id, player_id)
 
+    def push(self, move_id: int) -> None:
+        '''
+        Performs a move id for the player to move, then passes the turn to the opponent.
+        The move is not checked. It can be undone with pop.
+        '''
+        b0, b1 = self._bitboards
+        # undo record: both bitboards, the move id and the winner packed in a single int
+        self._undo.append(b0 | b1 << _B1_SHIFT | move_id << _MOVE_SHIFT | (self._winner + 1) << _WINNER_SHIFT)
+        self.__update(move_id, self.current_player_idx)
+        self.current_player_idx = 1 - self.current_player_idx
+        self.num_playes += 1
 
+    def pop(self) -> int:
+        '''Undoes the last push: board, player to move and move counter. Returns the move id'''
+        record = self._undo.pop()
+        self._bitboards = (record & bitboard.FULL, record >> _B1_SHIFT & bitboard.FULL)
+        self.current_player_idx = 1 - self.current_player_idx
+        self.num_playes -= 1
+        self._winner = (record >> _WINNER_SHIFT) - 1
+        return record >> _MOVE_SHIFT & _MOVE_MASK
 
-# Function for New Players
 
-    def available_moves(self, player_idx) -> list:
-        possible_moves = []
 
-        # Definisci le posizioni valide per il movimento
-        edge_positions = [(0, x) for x in range(5)] + [(4, x) for x in range(5)] + [(y, 0) for y in range(1, 4)] + [(y, 4) for y in range(1, 4)]
 
-        for from_pos in edge_positions:
-            for slide in Move:
-                if self.check_move(from_pos, slide, player_idx):
-                    possible_moves.append((from_pos, slide))
 
-        return possible_moves
+
+# Function for New Players
+
+    def available_moves(self, player_idx) -> list:
+        '''Returns the legal moves of the player as ((X, Y), Move), the format used by Player.make_move'''
+        return [_XY_MOVES[move_id] for move_id in bitboard.legal_moves(self._bitboards, player_idx)]
 
     def check_move(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool:
         '''Controlla se il movimento è valido per il giocatore specificato.'''
-        if player_id > 2:
-            return False
-        
-        app = (from_pos[1], from_pos[0])  # Ruota la posizione per il controllo
-
-        # Controlla il "take"
-        is_edge_position = (app[0] in [0, 4]) and (app[1] < 5)  # Posizione su un bordo
-        acceptable_take = is_edge_position and (self._board[app] < 0 or self._board[app] == player_id)
-
-        # Controlla lo "slide"
-        is_corner = app in [(0, 0), (0, 4), (4, 0), (4, 4)]
-        acceptable_slide = False
-
-        if is_corner:
-            acceptable_slide = (app == (0, 0) and slide in {Move.BOTTOM, Move.RIGHT}) or \
-                            (app == (4, 0) and slide in {Move.TOP, Move.RIGHT}) or \
-                            (app == (0, 4) and slide in {Move.BOTTOM, Move.LEFT}) or \
-                            (app == (4, 4) and slide in {Move.TOP, Move.LEFT})
-        else:
-            acceptable_slide = (app[0] == 0 and slide in {Move.BOTTOM, Move.LEFT, Move.RIGHT}) or \
-                            (app[0] == 4 and slide in {Move.TOP, Move.LEFT, Move.RIGHT}) or \
-                            (app[1] == 0 and slide in {Move.BOTTOM, Move.TOP, Move.RIGHT}) or \
-                            (app[1] == 4 and slide in {Move.BOTTOM, Move.TOP, Move.LEFT})
-
-        return acceptable_take and acceptable_slide
+        return self.__move_id((from_pos[1], from_pos[0]), slide, player_id) is not None
 
     def execute_move(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool:
         '''Esegue un movimento e restituisce se è stato effettuato con successo.'''
-        if player_id > 2:
-            return False
-
-        # Salva lo stato precedente del pezzo prima del movimento
-        prev_value = self._board[from_pos[1], from_pos[0]].copy()
-
-        # Funzione interna per eseguire il "take" e il "slide"
-        def take_and_slide(pos: tuple[int, int], slide: Move) -> bool:
-            take_ok = self.__take(pos, player_id)
-            if take_ok:
-                slide_ok = self.__slide(pos, slide)
-                if not slide_ok:
-                    self._board[pos] = prev_value  # Ripristina il pezzo se lo slide fallisce
-                return slide_ok
-            return False
-
-        move_ok = take_and_slide((from_pos[1], from_pos[0]), slide)
+        move_ok = self.__take_and_slide((from_pos[1], from_pos[0]), slide, player_id)
 
         if move_ok:
             self.current_player_idx = (self.current_player_idx + 1) % 2  # Cambia giocatore dopo il movimento
@@ -335,48 +283,35 @@ class Game(object):
 
 
     def possible_moves(self, player_id: int) -> list[tuple[tuple[int, int], Move]]:
-        '''Returns a list of possible moves for the player'''
-        moves = []
-        CORNER = [(0,0), (0,4), (4,4), (4,0)]
-        STEP = [1, 1, -1, -1]
-        MOVES = [Move.TOP, Move.RIGHT, Move.BOTTOM, Move.LEFT]
-        for i in range(len(CORNER)):
-            match i:
-                case 0:
-                    if self._board[CORNER[i]] == -1 or self._board[CORNER[i]] == player_id:
-                        moves.append((CORNER[i], Move.RIGHT))
-                        moves.append((CORNER[i], Move.BOTTOM))
-                case 1:
-                    if self._board[CORNER[i]] == -1 or self._board[CORNER[i]] == player_id:
-                        moves.append((CORNER[i], Move.LEFT))
-                        moves.append((CORNER[i], Move.BOTTOM))
-                case 2:
-                    if self._board[CORNER[i]] == -1 or self._board[CORNER[i]] == player_id:
-                        moves.append((CORNER[i], Move.LEFT))
-                        moves.append((CORNER[i], Move.TOP))
-                case 3:
-                    if self._board[CORNER[i]] == -1 or self._board[CORNER[i]] == player_id:
-                        moves.append((CORNER[i], Move.RIGHT))
-                        moves.append((CORNER[i], Move.TOP))
-                
-            for x in range(CORNER[i][0], CORNER[(i+1)%4][0]+STEP[i], STEP[i]):
-                for y in range(CORNER[i][1], CORNER[(i+1)%4][1]+STEP[i], STEP[i]):
-                    if (x,y) not in CORNER and (self._board[x,y] == -1 or self._board[x,y] == player_id):
-                        for j in range(len(MOVES)):
-                            if j!= i:
-                                moves.append(((x,y), MOVES[j]))
-        return moves
-    
+        '''Returns a list of possible moves for the player, positions are (row, col) as expected by move'''
+        return [_ROW_COL_MOVES[move_id] for move_id in bitboard.legal_moves(self._bitboards, player_id)]
+
 
     def qlearning_move(self, from_pos: tuple[int, int], slide: Move, player_id: int) -> bool: #Takes a position, a move, and a player ID. It performs a move if it is valid
         '''Perform a move'''
-        if player_id > 2:
-            return False
-        # Oh God, Numpy arrays
-        prev_value = deepcopy(self._board[(from_pos[1], from_pos[0])])
-        acceptable = self.__take((from_pos[1], from_pos[0]), player_id) #il metodo take controlla se la mossa è accettabile, sta qui sotto
-        if acceptable:
-            acceptable = self.__slide((from_pos[1], from_pos[0]), slide)
-            if not acceptable:
-                self._board[(from_pos[1], from_pos[0])] = deepcopy(prev_value)
-        return acceptable
\ No newline at end of file
+        return self.__take_and_slide((from_pos[1], from_pos[0]), slide, player_id)
+
+
+def encode_move(from_pos: tuple[int, int], slide: Move) -> int | None:
+    '''Returns the id of the move ((X, Y), slide), None if the slide is never allowed from that position'''
+    x, y = from_pos
+    if 0 <= x < bitboard.SIZE and 0 <= y < bitboard.SIZE:
+        return bitboard.MOVE_IDS[y][x][slide.value]
+    return None
+
+
+def decode_move(move_id: int) -> tuple[tuple[int, int], Move]:
+    '''Returns the move id as ((X, Y), slide), the format used by Player.make_move'''
+    return _XY_MOVES[move_id]
+
+
+# bit index of each cell, used to expand the bitboards into the 5x5 array
+_CELL_SHIFTS = np.arange(bitboard.SIZE * bitboard.SIZE, dtype=np.int64)
+# layout of the undo records
+_B1_SHIFT = bitboard.SIZE * bitboard.SIZE
+_MOVE_SHIFT = 2 * _B1_SHIFT
+_MOVE_MASK = (1 << 6) - 1
+_WINNER_SHIFT = _MOVE_SHIFT + 6
+# each move id in the two position formats used by Game
+_XY_MOVES = [((c, r), Move(s)) for r, c, s in bitboard.MOVES]
+_ROW_COL_MOVES = [((r, c), Move(s)) for r, c, s in bitboard.MOVES]
@@ -0,0 +1,136 @@
+'''
+Lazy SMP: parallel alpha-beta for MinMaxPlayer.
+
+While the player searches the root as usual, helper processes search the same root with the same
+iterative deepening, sharing the transposition table (transposition.SharedTranspositionTable).
+The helpers are staggered so that they do not repeat the main search: every other one starts one
+depth deeper, and each one perturbs its move ordering. What matters are the entries they store,
+which cut the main search short; the deepest completed iteration of any process is played.
+When the main search ends the helpers are stopped through a flag in shared memory.
+
+Run it to measure the time to reach a depth with more workers:
+    python lazy_smp.py --depth 4 --max-workers 8
+'''
+import argparse
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from game import Game
+from transposition import SharedTranspositionTable
+
+# helper players of this process, by name of their shared table: (player, stop flag, history before any search)
+_HELPERS = {}
+
+
+def _helper_search(config: dict, table_name: str, stop_name: str, bitboards: tuple[int, int], player_id: int,
+                   root_moves: list[int] | None, index: int, seed: int) -> tuple[list | None, int, int]:
+    '''Runs a helper search in a worker process, returns ([move id, score] or None, depth completed, nodes)'''
+    # imported here: minmaxPlayer imports this module
+    from players.minmaxPlayer import MinMaxPlayer
+    if table_name not in _HELPERS:
+        table = SharedTranspositionTable(config['tt_size'], config['tt_policy'], name=table_name)
+        player = MinMaxPlayer(player_id, **config, table=table)
+        # the mapping of the flag lives as long as the helper
+        stop = shared_memory.SharedMemory(name=stop_name)
+        player._stop = stop.buf
+        _HELPERS[table_name] = player, stop, player.history
+    player, _, history = _HELPERS[table_name]
+    # a different move ordering in every helper and decision, the noise of a decision is not kept
+    rng = random.Random(seed * 1000003 + index)
+    player.history = [[h + rng.randrange(64) for h in row] for row in history]
+    game = Game(showPrint=False)
+    game.set_position(bitboards, player_id)
+    return player.helper_search(game, root_moves, 1 + index % 2)
+
+
+class LazySMP:
+    def __init__(self, workers: int, config: dict, table: SharedTranspositionTable) -> None:
+        '''
+        workers counts the player's own process: workers - 1 helpers. config holds the arguments of
+        the helpers' MinMaxPlayer. The pool is started on the first search and kept until close
+        '''
+        if workers < 2:
+            raise ValueError(f'a parallel search needs at least 2 workers, got {workers}')
+        self.workers = workers
+        self.config = config
+        self.table = table
+        self._stop = shared_memory.SharedMemory(create=True, size=1)
+        self._pool = None
+        self._futures = []
+        self._decisions = 0
+
+    def start(self, bitboards: tuple[int, int], player_id: int, root_moves: list[int] | None) -> None:
+        '''Starts the helpers on the root, they search until finish is called or their budget is over'''
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers - 1)
+        self._stop.buf[0] = 0
+        self._decisions += 1
+        self._futures = [
+            self._pool.submit(_helper_search, self.config, self.table.name, self._stop.name, bitboards, player_id,
+                              root_moves, index, self._decisions)
+            for index in range(1, self.workers)
+        ]
+
+    def finish(self) -> list[tuple[list | None, int, int]]:
+        '''Stops the helpers, returns ([move id, score] or None, depth completed, nodes) of each one'''
+        self._stop.buf[0] = 1
+        results = [future.result() for future in self._futures]
+        self._futures = []
+        return results
+
+    def close(self) -> None:
+        '''Stops the worker processes and releases the stop flag'''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if self._stop is not None:
+            self._stop.close()
+            self._stop.unlink()
+            self._stop = None
+
+
+if __name__ == '__main__':
+    import bitboard
+    from players.minmaxPlayer import MinMaxPlayer
+
+    parser = argparse.ArgumentParser(description='Time to depth of the Lazy SMP search')
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--positions', type=int, default=8, help='positions of random games searched')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    positions = []
+    while len(positions) < args.positions:
+        bitboards, player_id = (0, 0), 0
+        for _ in range(rng.randrange(4, 20)):
+            move = rng.choice(bitboard.legal_moves(bitboards, player_id))
+            bitboards = bitboard.apply_move(bitboards, move, player_id)
+            player_id = 1 - player_id
+        if bitboard.winner(bitboards, player_id) == -1:
+            positions.append((bitboards, player_id))
+
+    workers = 1
+    base = None
+    while workers <= args.max_workers:
+        player = MinMaxPlayer(depth=args.depth, workers=workers)
+        elapsed = nodes = main_nodes = 0
+        for i, (bitboards, player_id) in enumerate(positions):
+            game = Game(showPrint=False)
+            game.set_position(bitboards, player_id)
+            # the first search starts the pool
+            if i == 0:
+                player.iterative_deepening(game)
+            player.tt.clear()
+            player.iterative_deepening(game)
+            elapsed += player.search_info['time']
+            nodes += player.search_info['nodes']
+            # the nodes of the player's own search: fewer as the helpers fill the table
+            main_nodes += player._nodes
+        player.close()
+        base = base or elapsed
+        print(f"workers={workers:3d}  time to depth {args.depth}={elapsed / len(positions):8.3f} s  "
+              f"nodes/s={nodes / elapsed:10.0f}  main nodes={main_nodes / len(positions):9.0f}  speedup={base / elapsed:5.2f}")
+        workers *= 2
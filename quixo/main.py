@@ -1,5 +1,5 @@
-from tqdm import tqdm
 from game import Game
+from tournament import run, print_summary
 
 from players.randomPlayer import RandomPlayer
 from players.myPlayer import MyPlayer
@@ -25,23 +25,8 @@ if __name__ == '__main__':
     
 
 
-    win0 =0
-    win1 =0
+    # MonteCarlo against Random, alternating the seats, see tournament.py
     nGame = 20
-    
-
-    for game in tqdm(range(nGame)):
-        g = Game(showPrint = False)
-
-        player0 = MonteCarloPlayer()
-        player1 = RandomPlayer()
-        winner = g.play(player0, player1)
-        
-        if winner:
-            win1+=1
-        else: 
-            win0+=1
-        
-    print("\nResult:")
-    print("\tWin Rate Player0: {:.2f}%".format((win0 / nGame) * 100))  
-    print("\tWin Rate Player1: {:.2f}%".format((win1 / nGame) * 100)) 
\ No newline at end of file
+    roster = [MonteCarloPlayer, RandomPlayer]
+    records = run(roster, nGame, mode='gauntlet', out='results.jsonl')
+    print_summary(records)
@@ -0,0 +1,210 @@
+'''
+Monte Carlo Tree Search (UCT) on the bitboards of bitboard.py.
+
+The tree is stored in flat lists indexed by node id, so that no object is created per node.
+Each node keeps the position, the player to move, the move that led to it and the statistics
+of the simulations that went through it. The tree survives between the decisions of a player:
+when the game reaches one of the grandchildren of the root (our move and the opponent's reply),
+that subtree becomes the new tree.
+'''
+import math
+import random
+import time
+
+import numpy as np
+
+import bitboard
+import rollout
+
+# result of a simulation which reached max_rollout_plies without a winner
+DRAW = 2
+
+
+class MCTS:
+    def __init__(self, exploration: float = math.sqrt(2), max_rollout_plies: int = 200, max_nodes: int = 1_000_000,
+                 rng: random.Random | None = None, rollouts_per_leaf: int = 1, symmetric_root: bool = True) -> None:
+        self.exploration = exploration
+        # moves which reach the same position are expanded once, at a new root the symmetric positions too
+        self.symmetric_root = symmetric_root
+        self.max_rollout_plies = max_rollout_plies
+        # with more than one rollout per leaf they are played in a batch, see rollout.py
+        self.rollouts_per_leaf = rollouts_per_leaf
+        # no node is expanded once the tree has max_nodes nodes, simulations still run from the leaves
+        self.max_nodes = max_nodes
+        self.rng = rng if rng is not None else random.Random()
+        self.np_rng = np.random.default_rng(self.rng.getrandbits(64))
+        self.simulations = 0
+        self.reset(None, 0)
+
+    def reset(self, bitboards: tuple[int, int] | None, player_id: int) -> None:
+        self.parent = []
+        self.move = []
+        self.bitboards = []
+        self.player = []       # player to move
+        self.winner = []       # winner of the position, -1 if the game is not over
+        self.children = []
+        self.untried = []      # moves to distinct positions not expanded yet, see bitboard.successors
+        self.visits = []       # rollouts that went through the node
+        self.wins = []         # wins of the player who moved into the node, draws count 0.5
+        self.root = -1
+        if bitboards is not None:
+            self.root = self._new_node(-1, -1, bitboards, player_id)
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def _new_node(self, parent: int, move: int, bitboards: tuple[int, int], player_id: int) -> int:
+        # the parent of a node is never over, only the lines changed by the move can be complete
+        if parent == -1:
+            winner = bitboard.winner(bitboards, player_id)
+        else:
+            winner = bitboard.winner_after(bitboards, move, player_id)
+        self.parent.append(parent)
+        self.move.append(move)
+        self.bitboards.append(bitboards)
+        self.player.append(player_id)
+        self.winner.append(winner)
+        self.children.append([])
+        symmetric = parent == -1 and self.symmetric_root
+        self.untried.append(bitboard.unique_moves(bitboards, player_id, symmetric) if winner == -1 else [])
+        self.visits.append(0)
+        self.wins.append(0.0)
+        return len(self.parent) - 1
+
+    def set_root(self, bitboards: tuple[int, int], player_id: int) -> bool:
+        '''
+        Moves the root to the given position. The current tree is reused if the position is the root
+        or one of the nodes two plies below it, otherwise a new tree is started.
+        Returns True if the tree was reused.
+        '''
+        state = (bitboards, player_id)
+        root = self.root
+        if root != -1:
+            if (self.bitboards[root], self.player[root]) == state:
+                return True
+            # different move pairs often reach the same position, keep the most explored subtree
+            matches = [
+                grandchild for child in self.children[root] for grandchild in self.children[child]
+                if (self.bitboards[grandchild], self.player[grandchild]) == state
+            ]
+            if matches:
+                self._reroot(max(matches, key=self.visits.__getitem__))
+                return True
+        self.reset(bitboards, player_id)
+        return False
+
+    def restrict_root(self, moves: list[int]) -> None:
+        '''Searches only the given moves of the root, see tactics.py'''
+        allowed = set(moves)
+        root = self.root
+        self.untried[root] = [move for move in self.untried[root] if move in allowed]
+        self.children[root] = [child for child in self.children[root] if self.move[child] in allowed]
+
+    def _reroot(self, new_root: int) -> None:
+        '''Keeps only the subtree of new_root, renumbering its nodes'''
+        order = [new_root]
+        for node in order:
+            order.extend(self.children[node])
+        index = {old: new for new, old in enumerate(order)}
+        parent = [index.get(self.parent[old], -1) for old in order]
+        parent[0] = -1
+        self.parent = parent
+        self.move = [self.move[old] for old in order]
+        self.bitboards = [self.bitboards[old] for old in order]
+        self.player = [self.player[old] for old in order]
+        self.winner = [self.winner[old] for old in order]
+        self.children = [[index[c] for c in self.children[old]] for old in order]
+        self.untried = [self.untried[old] for old in order]
+        self.visits = [self.visits[old] for old in order]
+        self.wins = [self.wins[old] for old in order]
+        self.root = 0
+
+    def search(self, iterations: int | None = None, time_limit: float | None = None) -> int:
+        '''Runs simulations from the root until one of the budgets is over, returns how many were run'''
+        if iterations is None and time_limit is None:
+            raise ValueError('at least one of iterations and time_limit is required')
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        done = 0
+        while iterations is None or done < iterations:
+            # the clock is read every few simulations, it costs as much as a short one
+            if deadline is not None and done & 15 == 0 and time.perf_counter() >= deadline:
+                break
+            self._iterate()
+            done += 1
+        self.simulations += done
+        return done
+
+    def _select(self, node: int) -> int:
+        '''Returns the child of node with the highest UCT value'''
+        visits, wins = self.visits, self.wins
+        scale = self.exploration * math.sqrt(math.log(visits[node]))
+        best, best_value = -1, -math.inf
+        for child in self.children[node]:
+            n = visits[child]
+            value = wins[child] / n + scale / math.sqrt(n)
+            if value > best_value:
+                best, best_value = child, value
+        return best
+
+    def _iterate(self) -> None:
+        node = self.root
+        untried, children, winner = self.untried, self.children, self.winner
+        # Selection: descend while the node is fully expanded
+        while not untried[node] and children[node]:
+            node = self._select(node)
+        # Expansion: add one random untried move
+        if untried[node] and len(self.parent) < self.max_nodes:
+            moves = untried[node]
+            i = self.rng.randrange(len(moves))
+            moves[i], moves[-1] = moves[-1], moves[i]
+            move = moves.pop()
+            player_id = self.player[node]
+            child = self._new_node(node, move, bitboard.apply_move(self.bitboards[node], move, player_id), 1 - player_id)
+            children[node].append(child)
+            node = child
+        # Simulation: counts[p] wins of player p, counts[2] draws
+        result = winner[node]
+        n = self.rollouts_per_leaf
+        if result != -1:
+            counts = [0, 0, 0]
+            counts[result] = n
+        elif n > 1:
+            counts = rollout.playouts(self.bitboards[node], self.player[node], n, self.np_rng, self.max_rollout_plies).tolist()
+        else:
+            counts = [0, 0, 0]
+            counts[self.rollout(self.bitboards[node], self.player[node])] = 1
+        # Backpropagation
+        parent, player, visits, wins = self.parent, self.player, self.visits, self.wins
+        draws = 0.5 * counts[2]
+        while node != -1:
+            visits[node] += n
+            # the player who moved into the node is the one not to move
+            wins[node] += counts[1 - player[node]] + draws
+            node = parent[node]
+
+    def rollout(self, bitboards: tuple[int, int], player_id: int) -> int:
+        '''Plays random moves until the end of the game, returns the winner or DRAW'''
+        result = bitboard.winner(bitboards, player_id)
+        if result != -1:
+            return result
+        choice, legal_moves, apply_move = self.rng.choice, bitboard.legal_moves, bitboard.apply_move
+        winner_after = bitboard.winner_after
+        for _ in range(self.max_rollout_plies):
+            move = choice(legal_moves(bitboards, player_id))
+            bitboards = apply_move(bitboards, move, player_id)
+            player_id = 1 - player_id
+            result = winner_after(bitboards, move, player_id)
+            if result != -1:
+                return result
+        return DRAW
+
+    def root_stats(self) -> list[tuple[int, int, float]]:
+        '''Returns (move id, visits, wins) of the children of the root'''
+        return [(self.move[c], self.visits[c], self.wins[c]) for c in self.children[self.root]]
+
+    def best_move(self) -> int:
+        '''Returns the most visited move of the root, -1 if no move has been expanded'''
+        stats = self.root_stats()
+        if not stats:
+            return -1
+        return max(stats, key=lambda s: (s[1], s[2]))[0]
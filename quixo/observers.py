@@ -0,0 +1,184 @@
+'''
+Observers of the games played by Game.play.
+
+An observer receives an event for every turn of the game, a dict:
+
+    ply          number of the turn, from 1
+    player       id of the player who moved
+    move         move id played (see bitboard.MOVES), -1 if every attempt was rejected
+    time         seconds spent in make_move, all the attempts of the turn included
+    rejected     attempts rejected as illegal before the move played
+    board_hash   position after the move, both bitboards packed in one int: b0 | b1 << 25
+    info         counters reported by the player for its decision (nodes searched, simulations,
+                 Q-table hits...), a copy of its search_info attribute, {} if it has none
+
+    observer = LatencyHistogram()
+    game.play(player0, player1, observers=[observer, MoveProfiler(plies=range(1, 11))])
+    observer.print_summary()
+
+Without observers Game.play runs its plain loop: nothing is timed or copied.
+'''
+import bisect
+import cProfile
+import json
+import math
+import pstats
+
+import bitboard
+
+
+class Observer:
+    '''Base class: every hook does nothing, subclasses override the ones they need'''
+
+    def game_start(self, game, players: list) -> None:
+        pass
+
+    def before_move(self, game, ply: int, player_id: int) -> None:
+        '''Called before the first make_move of the turn'''
+        pass
+
+    def after_move(self, event: dict) -> None:
+        '''Called once the move of the turn is played (or every attempt was rejected)'''
+        pass
+
+    def game_end(self, game, winner: int) -> None:
+        pass
+
+
+def board_hash(bitboards: tuple[int, int]) -> int:
+    '''The position as one int, different for every position'''
+    return bitboards[0] | bitboards[1] << bitboard.SIZE * bitboard.SIZE
+
+
+def agent_info(player) -> dict:
+    '''Returns a copy of the counters of the last decision of the player, see the search_info of the players'''
+    info = getattr(player, 'search_info', None)
+    return dict(info) if info else {}
+
+
+class MoveLog(Observer):
+    '''Keeps the events of the games, and appends them as JSON lines to path if given'''
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self.events = []
+        self.games = 0
+
+    def game_start(self, game, players: list) -> None:
+        self.games += 1
+
+    def after_move(self, event: dict) -> None:
+        event = dict(event, game=self.games)
+        self.events.append(event)
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(event) + '\n')
+
+
+class LatencyHistogram(Observer):
+    '''
+    Histogram of the time of the decisions of each player, with log-spaced buckets: bucket i counts
+    the decisions which took less than edges[i] seconds (and not less than edges[i - 1]).
+    Also counts the rejected attempts and sums the numeric counters reported by the players
+    '''
+
+    def __init__(self, min_time: float = 1e-6, max_time: float = 100.0, buckets_per_decade: int = 4) -> None:
+        decades = math.log10(max_time / min_time)
+        steps = int(round(decades * buckets_per_decade))
+        self.edges = [min_time * 10 ** (i / buckets_per_decade) for i in range(steps + 1)]
+        # per player id: bucket counts (the last one for the times beyond max_time), times, rejected, counters
+        self.counts = {}
+        self.times = {}
+        self.rejected = {}
+        self.counters = {}
+
+    def after_move(self, event: dict) -> None:
+        player = event['player']
+        if player not in self.counts:
+            self.counts[player] = [0] * (len(self.edges) + 1)
+            self.times[player] = []
+            self.rejected[player] = 0
+            self.counters[player] = {}
+        self.counts[player][bisect.bisect_right(self.edges, event['time'])] += 1
+        self.times[player].append(event['time'])
+        self.rejected[player] += event['rejected']
+        counters = self.counters[player]
+        for name, value in event['info'].items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                counters[name] = counters.get(name, 0) + value
+
+    def percentile(self, player_id: int, q: float) -> float:
+        '''Returns the q-th percentile (0-100) of the times of the player'''
+        times = sorted(self.times[player_id])
+        return times[min(len(times) - 1, int(len(times) * q / 100))]
+
+    def summary(self) -> dict[int, dict]:
+        '''Returns {player id: {moves, mean, p50, p90, p99, max, rejected, counters}}, times in seconds'''
+        result = {}
+        for player, times in sorted(self.times.items()):
+            result[player] = {
+                'moves': len(times),
+                'mean': sum(times) / len(times),
+                'p50': self.percentile(player, 50),
+                'p90': self.percentile(player, 90),
+                'p99': self.percentile(player, 99),
+                'max': max(times),
+                'rejected': self.rejected[player],
+                'counters': dict(self.counters[player]),
+            }
+        return result
+
+    def print_summary(self) -> None:
+        for player, s in self.summary().items():
+            print(f"player {player}: {s['moves']} moves  mean {s['mean'] * 1e3:.2f} ms  p50 {s['p50'] * 1e3:.2f} ms  "
+                  f"p90 {s['p90'] * 1e3:.2f} ms  p99 {s['p99'] * 1e3:.2f} ms  max {s['max'] * 1e3:.2f} ms  "
+                  f"rejected {s['rejected']}")
+            if s['counters']:
+                print('  ' + '  '.join(f'{name} {value:g}' for name, value in s['counters'].items()))
+            counts = self.counts[player]
+            # the buckets from the first to the last non-empty one
+            used = [i for i, count in enumerate(counts) if count]
+            for i in range(used[0], used[-1] + 1):
+                bound = f'< {self.edges[i] * 1e3:10.3f} ms' if i < len(self.edges) else f'>= {self.edges[-1] * 1e3:9.3f} ms'
+                print(f'  {bound}  {counts[i]:6d}  ' + '#' * round(50 * counts[i] / len(self.times[player])))
+
+
+class MoveProfiler(Observer):
+    '''
+    Runs cProfile around the selected moves: the ones of the plies given, of the players given,
+    or for which select(ply, player_id) is True. The profiles of all the games are accumulated
+    '''
+
+    def __init__(self, plies=None, players=None, select=None) -> None:
+        self.plies = set(plies) if plies is not None else None
+        self.players = set(players) if players is not None else None
+        self.select = select
+        self.profile = cProfile.Profile()
+        self.profiled = 0
+        self._running = False
+
+    def _selected(self, ply: int, player_id: int) -> bool:
+        if self.plies is not None and ply not in self.plies:
+            return False
+        if self.players is not None and player_id not in self.players:
+            return False
+        return self.select is None or self.select(ply, player_id)
+
+    def before_move(self, game, ply: int, player_id: int) -> None:
+        if self._selected(ply, player_id):
+            self.profile.enable()
+            self._running = True
+
+    def after_move(self, event: dict) -> None:
+        if self._running:
+            self.profile.disable()
+            self._running = False
+            self.profiled += 1
+
+    def stats(self) -> pstats.Stats:
+        '''Returns the statistics of the moves profiled so far, e.g. stats().sort_stats('cumulative').print_stats(20)'''
+        return pstats.Stats(self.profile)
+
+    def dump(self, path: str) -> None:
+        '''Writes the profile, readable by pstats and snakeviz'''
+        self.profile.dump_stats(path)
@@ -0,0 +1,205 @@
+'''
+Opening book: the moves of a deep search for the positions of the first plies, computed offline.
+
+The book holds every position reachable in the first plies from the empty board, each searched
+by MinMaxPlayer with a larger depth than a live decision can afford. Positions are stored once
+for the 8 rotations and reflections and for both seats: the key is the canonical state code of
+qtable.canonical_state (the boards swapped so that the player to move owns the first one), the
+move is stored in the frame of that code and moved back to the position asked for.
+The file holds the keys sorted, followed by the other fields:
+
+    magic (8 bytes) | number of entries n (uint64) | n keys (uint64) | n scores (float32)
+    | n move ids (uint8) | n depths (uint8)
+
+Like the Q-tables the book is opened with np.memmap and looked up with a binary search: a probe
+costs a few microseconds and the pages are shared by all the players and processes.
+
+    python opening_book.py --plies 4 --depth 5 --workers 8 --out opening_book.bin
+    book = opening_book.load('opening_book.bin')
+    move = book.probe(game._bitboards, player)  # -1 if the position is not in the book
+'''
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import bitboard
+from game import Game
+from players.impl.qtable import canonical_state
+from tactics import tactical_move
+
+MAGIC = b'QXBOOK01'
+_HEADER_SIZE = len(MAGIC) + 8
+# _TO_POSITION[s][move id] -> the move in the frame of the canonical code moved back by symmetry s
+_TO_POSITION = np.array([bitboard.MOVE_SYMMETRIES[bitboard.INVERSE_SYMMETRIES[s]]
+                         for s in range(bitboard.NUM_SYMMETRIES)], dtype=np.intp)
+
+
+def positions(plies: int) -> list[tuple[tuple[int, int], int]]:
+    '''
+    Returns (bitboards, player to move) of the positions reached from the empty board with fewer than
+    plies moves which are not over, one per canonical state code
+    '''
+    level = [((0, 0), 0)]
+    seen = {canonical_state((0, 0), 0)[0]}
+    result = list(level)
+    for _ in range(plies - 1):
+        following = []
+        for bitboards, player_id in level:
+            opponent = 1 - player_id
+            for move_id, child in bitboard.successors(bitboards, player_id):
+                if bitboard.winner_after(child, move_id, opponent) != -1:
+                    continue
+                code = canonical_state(child, opponent)[0]
+                if code not in seen:
+                    seen.add(code)
+                    following.append((child, opponent))
+        result.extend(following)
+        level = following
+    return result
+
+
+def _search_positions(positions: list, depth: int, time_limit: float | None, evaluation) -> list[tuple[int, float]]:
+    '''Returns (move id, score for the player to move) of each position, searched in a worker process'''
+    # imported here: the players import this module to read the books
+    from players.minmaxPlayer import MinMaxPlayer
+    searcher = MinMaxPlayer(depth=depth, time_limit=time_limit, evaluation=evaluation)
+    results = []
+    for bitboards, player_id in positions:
+        move, _ = tactical_move(bitboards, player_id)
+        if move != -1:
+            # a win on the spot, or the only move which does not lose at once
+            child = bitboard.apply_move(bitboards, move, player_id)
+            results.append((move, 1.0 if bitboard.winner_after(child, move, 1 - player_id) == player_id else 0.0))
+            continue
+        game = Game(showPrint=False)
+        game.set_position(bitboards, player_id)
+        move, score = searcher.iterative_deepening(game)
+        results.append((move, float(score)))
+    return results
+
+
+def build(path: str, plies: int = 4, depth: int = 4, time_limit: float | None = None, workers: int | None = None,
+          evaluation='default', progress: bool = True) -> int:
+    '''
+    Searches the positions of the first plies (see positions) with MinMaxPlayer(depth, time_limit, evaluation)
+    on a process pool and writes the book to path. Returns the number of positions
+    '''
+    todo = positions(plies)
+    workers = workers if workers is not None else os.cpu_count()
+    # small tasks, so that the slow positions of the later plies are spread over the workers
+    size = max(1, len(todo) // (8 * workers))
+    tasks = [todo[i:i + size] for i in range(0, len(todo), size)]
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        iterator = pool.map(_search_positions, tasks, [depth] * len(tasks), [time_limit] * len(tasks),
+                            [evaluation] * len(tasks))
+        if progress:
+            from tqdm import tqdm
+            iterator = tqdm(iterator, total=len(tasks))
+        for task_results in iterator:
+            results.extend(task_results)
+
+    keys = np.zeros(len(todo), dtype=np.uint64)
+    moves = np.zeros(len(todo), dtype=np.uint8)
+    scores = np.zeros(len(todo), dtype=np.float32)
+    for i, ((bitboards, player_id), (move, score)) in enumerate(zip(todo, results)):
+        code, symmetry = canonical_state(bitboards, player_id)
+        keys[i] = code
+        moves[i] = bitboard.MOVE_SYMMETRIES[symmetry][move]
+        scores[i] = score
+    _write(path, keys, scores, moves, np.full(len(todo), depth, dtype=np.uint8))
+    if progress:
+        print(f'{len(todo)} positions in {time.perf_counter() - start:.1f} s')
+    return len(todo)
+
+
+def _write(path: str, keys: np.ndarray, scores: np.ndarray, moves: np.ndarray, depths: np.ndarray) -> None:
+    '''Writes the entries sorted by key. The file is replaced atomically'''
+    order = np.argsort(keys, kind='stable')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(keys)).tobytes())
+        keys[order].astype(np.uint64).tofile(f)
+        scores[order].astype(np.float32).tofile(f)
+        moves[order].astype(np.uint8).tofile(f)
+        depths[order].astype(np.uint8).tofile(f)
+    os.replace(tmp, path)
+
+
+class OpeningBook:
+    '''Read-only view of a book written by build'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+        if len(header) != _HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not an opening book file')
+        n = int(np.frombuffer(header, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        if n == 0:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.scores = np.zeros(0, dtype=np.float32)
+            self.moves = np.zeros(0, dtype=np.uint8)
+            self.depths = np.zeros(0, dtype=np.uint8)
+        else:
+            self.keys = np.memmap(path, dtype=np.uint64, mode='r', offset=_HEADER_SIZE, shape=(n,))
+            self.scores = np.memmap(path, dtype=np.float32, mode='r', offset=_HEADER_SIZE + 8 * n, shape=(n,))
+            self.moves = np.memmap(path, dtype=np.uint8, mode='r', offset=_HEADER_SIZE + 12 * n, shape=(n,))
+            self.depths = np.memmap(path, dtype=np.uint8, mode='r', offset=_HEADER_SIZE + 13 * n, shape=(n,))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def entry(self, bitboards: tuple[int, int], player_id: int) -> tuple[int, float, int] | None:
+        '''Returns (move id, score for the player to move, depth of the search) of the position, None if it is not in the book'''
+        code, symmetry = canonical_state(bitboards, player_id)
+        key = np.uint64(code)
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return int(_TO_POSITION[symmetry, self.moves[i]]), float(self.scores[i]), int(self.depths[i])
+
+    def probe(self, bitboards: tuple[int, int], player_id: int) -> int:
+        '''Returns the move id of the book for player_id to move, -1 if the position is not in the book'''
+        found = self.entry(bitboards, player_id)
+        return found[0] if found is not None else -1
+
+    def stats(self) -> dict:
+        '''Returns the counters of the probes'''
+        probes = self.hits + self.misses
+        return {'size': len(self.keys), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / probes if probes else 0.0}
+
+
+# books already opened in this process, by path and modification time
+_OPENED = {}
+
+
+def load(path: str) -> OpeningBook:
+    '''Opens a book, reusing the mapping if the same file was already opened by this process'''
+    key = (os.path.realpath(path), os.stat(path).st_mtime_ns)
+    book = _OPENED.get(key)
+    if book is None:
+        book = _OPENED[key] = OpeningBook(path)
+    return book
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the opening book with a deep search of the first plies')
+    parser.add_argument('--plies', type=int, default=4, help='positions reached with fewer moves than this')
+    parser.add_argument('--depth', type=int, default=4, help='depth of the search of each position')
+    parser.add_argument('--time-limit', type=float, default=None, help='seconds for the search of each position')
+    parser.add_argument('--evaluation', default='default', help='config of evaluation.WEIGHT_CONFIGS or JSON file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='opening_book.bin')
+    args = parser.parse_args()
+
+    build(args.out, args.plies, args.depth, args.time_limit, args.workers, args.evaluation)
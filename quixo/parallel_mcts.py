@@ -0,0 +1,111 @@
+'''
+Root-parallel Monte Carlo Tree Search.
+
+Every worker process builds its own UCT tree (see mcts.py) from the same position with its own
+seed, then the visits and wins of the moves of the root are summed over the workers and the most
+visited move is played. The number of simulations per decision grows with the number of workers.
+
+Run it to measure how the simulations per second scale with the workers:
+    python parallel_mcts.py --iterations 2000
+'''
+import argparse
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mcts import MCTS
+
+
+def _search_worker(bitboards: tuple[int, int], player_id: int, iterations: int | None, time_limit: float | None,
+                   exploration: float, rollouts_per_leaf: int, seed: int,
+                   moves: list[int] | None = None) -> tuple[list[tuple[int, int, float]], int]:
+    '''Runs one tree search, returns the statistics of the root and the simulations run'''
+    tree = MCTS(exploration=exploration, rng=random.Random(seed), rollouts_per_leaf=rollouts_per_leaf)
+    tree.reset(bitboards, player_id)
+    if moves is not None:
+        tree.restrict_root(moves)
+    done = tree.search(iterations, time_limit)
+    return tree.root_stats(), done
+
+
+class RootParallelMCTS:
+    def __init__(self, workers: int | None = None, exploration: float = math.sqrt(2), rollouts_per_leaf: int = 1,
+                 seed: int | None = None) -> None:
+        '''workers defaults to the number of CPUs. The pool is started on the first search and kept until close'''
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.exploration = exploration
+        self.rollouts_per_leaf = rollouts_per_leaf
+        # worker w of decision d always gets the same seed
+        self._seeds = np.random.SeedSequence(seed)
+        self._pool = None
+        self.simulations = 0
+        self.stats = {}
+
+    def search(self, bitboards: tuple[int, int], player_id: int, iterations: int | None = None,
+               time_limit: float | None = None, moves: list[int] | None = None) -> dict[int, tuple[int, float]]:
+        '''
+        Each worker runs iterations simulations or searches for time_limit seconds. Returns {move id: (visits, wins)}.
+        moves restricts the moves searched at the root
+        '''
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        decision_seeds = self._seeds.spawn(1)[0]
+        seeds = [int(s.generate_state(1)[0]) for s in decision_seeds.spawn(self.workers)]
+        futures = [
+            self._pool.submit(_search_worker, bitboards, player_id, iterations, time_limit, self.exploration,
+                              self.rollouts_per_leaf, seed, moves)
+            for seed in seeds
+        ]
+        merged = {}
+        for future in futures:
+            root_stats, done = future.result()
+            self.simulations += done
+            for move, visits, wins in root_stats:
+                v, w = merged.get(move, (0, 0.0))
+                merged[move] = (v + visits, w + wins)
+        self.stats = merged
+        return merged
+
+    def best_move(self) -> int:
+        '''Returns the most visited move of the last search, -1 if there is none'''
+        if not self.stats:
+            return -1
+        return max(self.stats, key=lambda move: self.stats[move])
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __getstate__(self) -> dict:
+        # the pool cannot be pickled, a copy starts its own
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulations per second of the root-parallel search')
+    parser.add_argument('--iterations', type=int, default=2000, help='simulations per worker')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    workers = 1
+    base = None
+    while workers <= args.max_workers:
+        search = RootParallelMCTS(workers=workers, seed=0)
+        # warm up the pool, the processes are started once per player
+        search.search((0, 0), 0, iterations=1)
+        search.simulations = 0
+        start = time.perf_counter()
+        search.search((0, 0), 0, iterations=args.iterations)
+        elapsed = time.perf_counter() - start
+        search.close()
+        rate = search.simulations / elapsed
+        base = base or rate
+        print(f"workers={workers:3d}  simulations/s={rate:10.0f}  speedup={rate / base:5.2f}")
+        workers *= 2
@@ -0,0 +1,110 @@
+'''
+Linear Q-function on board features.
+
+Q(s, a) is the dot product of a weight vector with the features of the position after the move,
+seen by the player who moved (mine / theirs pieces), so the same weights serve both seats and
+every position, seen in training or not, gets a value. The features are symmetric (they do not
+change with the 8 rotations and reflections of the board):
+
+    bias | my pieces in each orbit of cells | their pieces in each orbit of cells |
+    lines with k of my pieces (k = 1..5) | lines with k of theirs | lines with k of mine and none
+    of theirs (k = 1..4) | lines with k of theirs and none of mine
+
+The orbits are the classes of cells which the symmetries exchange (corners, center, ...).
+All the legal moves of a position are valued with one batch of array operations.
+'''
+import os
+
+import numpy as np
+
+import bitboard
+import rollout
+
+# column i of the bit matrices is the cell with bit i
+_CELL_BITS = np.arange(bitboard.SIZE * bitboard.SIZE, dtype=np.int64)
+# _LINE_MATRIX[cell, line] = 1 if the line goes through the cell
+_LINE_MATRIX = np.array(
+    [[mask >> cell & 1 for mask in bitboard.LINE_MASKS] for cell in _CELL_BITS.tolist()], dtype=np.float32
+)
+_ORBITS = sorted({min(cells[i] for cells in bitboard.CELL_SYMMETRIES) for i in _CELL_BITS.tolist()})
+# _ORBIT_MATRIX[cell, orbit] = 1 / orbit size if the cell belongs to the orbit: the fraction of the orbit owned
+_ORBIT_MATRIX = np.array(
+    [[min(cells[i] for cells in bitboard.CELL_SYMMETRIES) == orbit for orbit in _ORBITS] for i in _CELL_BITS.tolist()],
+    dtype=np.float32,
+)
+_ORBIT_MATRIX /= _ORBIT_MATRIX.sum(axis=0)
+_COUNTS = np.arange(1, bitboard.SIZE + 1)
+_OPEN_COUNTS = np.arange(1, bitboard.SIZE)
+NUM_FEATURES = 1 + 2 * len(_ORBITS) + 2 * len(_COUNTS) + 2 * len(_OPEN_COUNTS)
+
+
+def features(mine: np.ndarray, theirs: np.ndarray) -> np.ndarray:
+    '''Returns the (N, NUM_FEATURES) features of N positions given as the bitboards of the two players'''
+    m = ((mine[:, None] >> _CELL_BITS) & 1).astype(np.float32)
+    t = ((theirs[:, None] >> _CELL_BITS) & 1).astype(np.float32)
+    # pieces of each player on each line, (N, 12)
+    m_lines = m @ _LINE_MATRIX
+    t_lines = t @ _LINE_MATRIX
+    n_lines = len(bitboard.LINE_MASKS)
+    m_open = np.where(t_lines == 0, m_lines, 0)[:, :, None]
+    t_open = np.where(m_lines == 0, t_lines, 0)[:, :, None]
+    return np.concatenate([
+        np.ones((len(mine), 1), dtype=np.float32),
+        m @ _ORBIT_MATRIX,
+        t @ _ORBIT_MATRIX,
+        (m_lines[:, :, None] == _COUNTS).sum(axis=1) / n_lines,
+        (t_lines[:, :, None] == _COUNTS).sum(axis=1) / n_lines,
+        (m_open == _OPEN_COUNTS).sum(axis=1) / n_lines,
+        (t_open == _OPEN_COUNTS).sum(axis=1) / n_lines,
+    ], axis=1, dtype=np.float32)
+
+
+def afterstate_features(b0, b1, player_id: int, actions) -> np.ndarray:
+    '''
+    Returns the features of the positions after player_id performed each of the actions, seen by player_id.
+    b0 and b1 are the bitboards of one position or arrays with one position per action
+    '''
+    actions = np.asarray(actions, dtype=np.intp)
+    n = len(actions)
+    b0 = np.broadcast_to(np.asarray(b0, dtype=np.int64), n)
+    b1 = np.broadcast_to(np.asarray(b1, dtype=np.int64), n)
+    b0, b1 = rollout.apply_moves(b0, b1, np.full(n, player_id, dtype=np.int64), actions)
+    return features(b1, b0) if player_id else features(b0, b1)
+
+
+class LinearQ:
+    '''Weights of the linear Q-function, NUM_FEATURES float32 values whatever the positions learned'''
+
+    def __init__(self, weights: np.ndarray | None = None) -> None:
+        if weights is None:
+            weights = np.zeros(NUM_FEATURES, dtype=np.float32)
+        elif weights.shape != (NUM_FEATURES,):
+            raise ValueError(f'expected {NUM_FEATURES} weights, got shape {weights.shape}')
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    def q_values(self, bitboards: tuple[int, int], player_id: int, actions) -> np.ndarray:
+        '''Returns the values of the actions (move ids) of player_id in the position'''
+        return afterstate_features(bitboards[0], bitboards[1], player_id, actions) @ self.weights
+
+    def move_values(self, bitboards: tuple[int, int], player_id: int) -> np.ndarray:
+        '''Returns the values of the 44 moves, as qtable.QTableFile.move_values. Only the legal ones are meaningful'''
+        return self.q_values(bitboards, player_id, np.arange(bitboard.NUM_MOVES))
+
+    def fit(self, phi: np.ndarray, targets: np.ndarray, alpha: float) -> None:
+        '''
+        One step of normalized least mean squares on the rows of features phi: the mean of the steps
+        which would move each value by alpha times its error
+        '''
+        errors = (targets - phi @ self.weights) / (phi * phi).sum(axis=1)
+        self.weights += (alpha * errors @ phi / len(phi)).astype(np.float32)
+
+    def save(self, path: str) -> None:
+        '''Writes the weights as a .npy file. The file is replaced atomically'''
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, self.weights)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LinearQ':
+        return cls(np.load(path))
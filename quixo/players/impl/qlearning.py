@@ -1,55 +1,52 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import random
+import time
 import numpy as np
 from tqdm import tqdm
-from game import Game, Move
-from copy import deepcopy
-import random
-import sys
-import struct
+from bitboard import MOVE_SYMMETRIES, apply_move, legal_moves, unique_moves, winner_after
+from players.impl import linearq, qtable
+from records import GameRecordWriter
 
 
 class Qlearning:
-    def __init__(self, alpha, gamma, epsilon, player):
+    def __init__(self, alpha, gamma, epsilon, player, swap_players=False, max_entries=None):
         self.alpha = alpha
         self.gamma = gamma
         self.epsilon = epsilon
-        self.q_table = {}
+        # at most max_entries pairs, see qtable.QStore
+        self.q_table = qtable.QStore(max_entries)
         self.player= player
+        # keys independent of the seat, the same table can learn both
+        self.swap_players = swap_players
 
-    def compact_string(self, matrix):
-        matrix = matrix.flatten()
-        compressed_data = struct.pack(f">{len(matrix)}b", *matrix)
-              
-        return compressed_data
-    
-    def compact_move(self,t):
-        string=str(t[0][0])+str(t[0][1])+str(t[1].value)
-        string = string.encode('utf-8')
-        return string
-    
-    def decode_move(self,t):
-        t = t.decode('utf-8')
-        return (int(t[0]), int(t[1])), Move(int(t[2]))
+    def compact_state(self, bitboards):
+        # (canonical state code, symmetry which moves the actions to its frame)
+        return qtable.canonical_state(bitboards, self.player if self.swap_players else None)
     
     def set_epsilon(self, epsilon):
         self.epsilon = epsilon
 
     def get_q_table(self):
         return self.q_table
+
+    def save(self, path):
+        self.q_table.save(path)
     
     def get_q_value(self, state, action):
-        if (state, action) not in self.q_table:
-            self.q_table[(state, action)] = 0
-        return self.q_table[(state, action)]
+        return self.q_table.get(state, action)
     
     def choice_action(self, state, actions):
         if np.random.uniform() < self.epsilon:
             return actions[np.random.choice(range(len(actions)))]
         else:
-            state = self.compact_string(state)
-            actions = [self.compact_move(action) for action in actions]
-            q_values = np.array([self.get_q_value(state, action) for action in actions])
+            state, symmetry = self.compact_state(state)
+            moves = MOVE_SYMMETRIES[symmetry]
+            q_values = np.array([self.get_q_value(state, moves[action]) for action in actions])
             maximum = np.max(q_values)
-            return self.decode_move(actions[np.random.choice(np.where(q_values == maximum)[0])])
+            return actions[np.random.choice(np.where(q_values == maximum)[0])]
     
     def reward(self, win):
         if win == self.player:
@@ -61,77 +58,211 @@ class Qlearning:
         
     def update(self, trajectory, reward):
         for state, action in trajectory:
-            state = self.compact_string(state)
-            action = self.compact_move(action)
-            self.q_table[(state, action)] = self.get_q_value(state, action) + self.alpha * (reward - self.get_q_value(state, action))
+            state, symmetry = self.compact_state(state)
+            action = MOVE_SYMMETRIES[symmetry][action]
+            value = self.get_q_value(state, action)
+            self.q_table.set(state, action, value + self.alpha * (reward - value))
             reward = reward * self.gamma
 
- 
-if __name__ == '__main__':
-    Q = Qlearning(0.5, 0.9, 1, 1)
-    games = 25000
-    epsilon = np.linspace(1, 0, num=games, endpoint=True)
-    
-    #Training secondo giocatore
-    for i in tqdm(range(games)):
-        Q.set_epsilon(epsilon[i])
-        game = Game()
-        player = 0
-        trajectory = []
-
-        while game.check_winner() == -1:
-            state = game.get_board()
-            actions = game.possible_moves(player)
-            action = random.choice(actions)
-            game.move(action[0], action[1], player)
-
-            if game.check_winner() != -1:
-                break
-            player = 1 - player
 
-            state = game.get_board()
-            actions = game.possible_moves(player)
-            action = Q.choice_action(state, actions)
-            game.move(action[0], action[1], player)
-            trajectory.append((state, action))
+class LinearQlearning(Qlearning):
+    '''Q-learning with the linear function of linearq.py instead of a table: constant memory, values for unseen positions'''
+
+    def __init__(self, alpha, gamma, epsilon, player, weights=None):
+        self.alpha = alpha
+        self.gamma = gamma
+        self.epsilon = epsilon
+        self.q_table = linearq.LinearQ(weights)
+        self.player = player
+
+    def compact_state(self, bitboards):
+        return bitboards
+
+    def get_q_value(self, state, action):
+        return float(self.q_table.q_values(state, self.player, [action])[0])
+
+    def choice_action(self, state, actions):
+        if np.random.uniform() < self.epsilon:
+            return actions[np.random.choice(range(len(actions)))]
+        else:
+            q_values = self.q_table.q_values(state, self.player, actions)
+            maximum = np.max(q_values)
+            return actions[np.random.choice(np.where(q_values == maximum)[0])]
+
+    def update(self, trajectory, reward):
+        if not trajectory:
+            return
+        # same targets as the table, all the moves of the game in one batch
+        states = np.array([state for state, _ in trajectory], dtype=np.int64)
+        actions = [action for _, action in trajectory]
+        phi = linearq.afterstate_features(states[:, 0], states[:, 1], self.player, actions)
+        targets = reward * self.gamma ** np.arange(len(trajectory), dtype=np.float32)
+        self.q_table.fit(phi, targets, self.alpha)
 
-            player = 1 - player
 
-        Q.update(trajectory, Q.reward(game.check_winner()))
-        trajectory = []
+# a training game without a winner after this many plies is a draw
+MAX_PLIES = 1000
 
-    with open('players/impl/Q_table1.txt', 'w') as f:
-        for key, value in Q.get_q_table().items():
-            print(key[0], key[1], value, file=f)
 
-    #Training primo giocatore
-    for i in tqdm(range(games)):
-        Q.set_epsilon(epsilon[i])
-        game = Game()
-        player = 1
-        trajectory = []
+def play_training_game(table, seat, epsilon, rng, swap_players=False, moves=None):
+    '''
+    Plays the agent (pieces of seat, player 0 moves first) against a random opponent.
+    The agent is epsilon-greedy on table, a qtable.QTableFile or None for a random agent.
+    Returns the trajectory of the agent as (bitboards, move id) and the winner.
+    The move ids of both players are appended to moves if given
+    '''
+    bitboards = (0, 0)
+    player = 0
+    trajectory = []
+    for _ in range(MAX_PLIES):
+        if player == seat:
+            # one move per distinct position reached, see bitboard.successors
+            actions = unique_moves(bitboards, player)
+            if table is None or rng.random() < epsilon:
+                action = rng.choice(actions)
+            else:
+                q_values = table.move_values(bitboards, seat if swap_players else None)[list(actions)]
+                best = np.flatnonzero(q_values == q_values.max())
+                action = actions[best[rng.randrange(len(best))]]
+            trajectory.append((bitboards, action))
+        else:
+            action = rng.choice(legal_moves(bitboards, player))
+        if moves is not None:
+            moves.append(action)
+        bitboards = apply_move(bitboards, action, player)
+        player = 1 - player
+        win = winner_after(bitboards, action, player)
+        if win != -1:
+            return trajectory, win
+    return trajectory, -1
 
-        while game.check_winner() == -1:
-            state = game.get_board()
-            actions = game.possible_moves(player)
-            action = random.choice(actions)
-            game.move(action[0], action[1], player)
 
-            if game.check_winner() != -1:
+def _actor(seat, snapshot, epsilon, stop, results, batch_size, seed, linear=False, record=False):
+    '''
+    Plays games with the last snapshot of the learner's table and sends them in batches of (seat, trajectory, winner, moves).
+    With seat None the table is shared by the seats and the agent alternates them. linear: the snapshot holds linearq weights.
+    moves are the move ids of the game with record, otherwise None
+    '''
+    rng = random.Random(seed)
+    games = 0
+    load = linearq.LinearQ.load if linear else qtable.load
+    table, mtime = None, None
+    while not stop.is_set():
+        # reloaded only when the learner has written a new snapshot
+        current = os.stat(snapshot).st_mtime_ns if os.path.exists(snapshot) else None
+        if current != mtime:
+            table, mtime = (load(snapshot) if current is not None else None), current
+        batch = []
+        for _ in range(batch_size):
+            game_seat = seat if seat is not None else games % 2
+            moves = [] if record else None
+            trajectory, win = play_training_game(table, game_seat, epsilon.value, rng, seat is None or linear, moves)
+            batch.append((game_seat, trajectory, win, moves))
+            games += 1
+        while not stop.is_set():
+            try:
+                results.put(batch, timeout=0.1)
                 break
-            player = 1 - player
+            except queue.Full:
+                pass
+
 
-            state = game.get_board()
-            actions = game.possible_moves(player)
-            action = Q.choice_action(state, actions)
-            game.move(action[0], action[1], player)
-            trajectory.append((state, action))
+def train(seat, games, path, workers=None, alpha=0.5, gamma=0.9, batch_size=32, sync_every=2000, seed=0, max_entries=None,
+          linear=False, records=None):
+    '''
+    Trains the table of seat on games games and saves it to path. With seat None a single table,
+    keyed from the point of view of the player to move, learns both seats.
+    Actor processes play the games, this process is the learner: it applies Qlearning.update to the
+    trajectories as they arrive, lowers epsilon linearly from 1 to 0 with the games learned and
+    every sync_every games writes a snapshot of the table that the actors reload.
+    max_entries bounds the memory of the table, see qtable.QStore. With linear the learner fits the weights of
+    linearq.LinearQ (alpha is the step of LinearQ.fit) and path is a .npy file. With records the games played are
+    appended to the game records in that directory, see records.py
+    '''
+    workers = workers if workers is not None else os.cpu_count()
+    if linear:
+        learners = [LinearQlearning(alpha, gamma, 1, seat) for seat in (0, 1)]
+        learners[1].q_table = learners[0].q_table
+    elif seat is None:
+        # one learner per seat for the rewards and the keys, on the same dict
+        learners = [Qlearning(alpha, gamma, 1, seat, True, max_entries) for seat in (0, 1)]
+        learners[1].q_table = learners[0].q_table
+    else:
+        learners = {seat: Qlearning(alpha, gamma, 1, seat, max_entries=max_entries)}
+    Q = learners[seat if seat is not None else 0]
+    snapshot = path + '.snapshot'
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+    epsilon = mp.Value('d', 1.0)
+    stop = mp.Event()
+    results = mp.Queue(maxsize=4 * workers)
+    actors = [
+        mp.Process(target=_actor,
+                   args=(seat, snapshot, epsilon, stop, results, batch_size, seed * workers + i, linear, records is not None),
+                   daemon=True)
+        for i in range(workers)
+    ]
+    for actor in actors:
+        actor.start()
 
-            player = 1 - player
+    writer = GameRecordWriter(records) if records is not None else None
+    done = updates = last_sync = 0
+    start = time.perf_counter()
+    with tqdm(total=games) as bar:
+        while done < games:
+            batch = results.get()
+            for game_seat, trajectory, win, moves in batch[:games - done]:
+                learner = learners[game_seat]
+                learner.update(trajectory, learner.reward(win))
+                updates += len(trajectory)
+                if writer is not None:
+                    writer.append(moves, win)
+            bar.update(min(len(batch), games - done))
+            done = min(done + len(batch), games)
+            epsilon.value = 1 - done / games
+            if done - last_sync >= sync_every:
+                Q.save(snapshot)
+                last_sync = done
+            elapsed = time.perf_counter() - start
+            bar.set_postfix(games_s=f"{done / elapsed:.0f}", updates_s=f"{updates / elapsed:.0f}", epsilon=f"{epsilon.value:.2f}",
+                            **({} if linear else {'size': len(Q.q_table), 'evictions': Q.q_table.evictions}))
 
-        Q.update(trajectory, Q.reward(game.check_winner()))
-        trajectory = []
+    stop.set()
+    for actor in actors:
+        actor.join(timeout=5)
+        if actor.is_alive():
+            actor.terminate()
+    if writer is not None:
+        writer.close()
+    Q.save(path)
+    if os.path.exists(snapshot):
+        os.remove(snapshot)
+    return Q
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the Q-tables of both seats against a random opponent')
+    parser.add_argument('--games', type=int, default=25000, help='games for each seat')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='actor processes')
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--gamma', type=float, default=0.9)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-entries', type=int, default=None, help='bound of the pairs kept in memory by the learner')
+    parser.add_argument('--linear', action='store_true', help='train the linear Q-function of both seats, Q_linear.npy')
+    parser.add_argument('--shared', action='store_true', help='train a single table for both seats, Q_table.bin')
+    parser.add_argument('--records', default=None, help='directory where the training games are recorded')
+    args = parser.parse_args()
 
-    with open('players/impl/Q_table0.txt', 'w') as f:
-        for key, value in Q.get_q_table().items():
-            print(key[0], key[1], value, file=f)
\ No newline at end of file
+    if args.linear:
+        train(None, 2 * args.games, 'players/impl/Q_linear.npy', args.workers, args.alpha, args.gamma, seed=args.seed,
+              linear=True, records=args.records)
+    elif args.shared:
+        train(None, 2 * args.games, 'players/impl/Q_table.bin', args.workers, args.alpha, args.gamma, seed=args.seed,
+              max_entries=args.max_entries, records=args.records)
+    else:
+        #Training secondo giocatore
+        train(1, args.games, 'players/impl/Q_table1.bin', args.workers, args.alpha, args.gamma, seed=args.seed,
+              max_entries=args.max_entries, records=args.records)
+        #Training primo giocatore
+        train(0, args.games, 'players/impl/Q_table0.bin', args.workers, args.alpha, args.gamma, seed=args.seed,
+              max_entries=args.max_entries, records=args.records)
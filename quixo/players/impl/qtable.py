@@ -0,0 +1,253 @@
+'''
+Binary Q-table files.
+
+A state is the packed integer b0 | b1 << 25 of the two bitboards (2 bits per cell, see bitboard.py)
+and an action is a move id, so every (state, action) pair fits in one uint64 key: state << 6 | action.
+The 8 rotations and reflections of a position are stored once: the key is the smallest of their
+state codes, and the action is moved by the same symmetry (see canonical_state). With the boards
+swapped so that the player to move owns the first one, a table serves both seats.
+The file holds the keys sorted, followed by the values as float32:
+
+    magic (8 bytes) | number of entries n (uint64) | n keys (uint64) | n values (float32)
+
+Tables are opened with np.memmap and looked up with a binary search, so loading is immediate and
+all the players and processes which open the same file share the pages of the OS cache.
+'''
+import os
+
+import numpy as np
+
+import bitboard
+
+# version 02: canonical keys
+MAGIC = b'QXQTAB02'
+_HEADER_SIZE = len(MAGIC) + 8
+ACTION_BITS = 6
+_ACTION_MASK = (1 << ACTION_BITS) - 1
+_BOARD_BITS = bitboard.SIZE * bitboard.SIZE
+
+
+def state_code(bitboards: tuple[int, int]) -> int:
+    '''Packs the position in a single integer'''
+    return bitboards[0] | bitboards[1] << _BOARD_BITS
+
+
+# MOVE_MAPS[s][move id] -> id of the move on the board moved by symmetry s
+MOVE_MAPS = np.array(bitboard.MOVE_SYMMETRIES, dtype=np.intp)
+
+
+def canonical_state(bitboards: tuple[int, int], player_id: int | None = None) -> tuple[int, int]:
+    '''
+    Returns (state code, symmetry) of the symmetric position with the smallest code, i.e. the
+    lexicographically smallest board. Move ids are moved to its frame with MOVE_SYMMETRIES[symmetry].
+    With player_id the boards are swapped when player 1 is to move, so that the code does not depend on the seat
+    '''
+    if player_id == 1:
+        bitboards = bitboards[1], bitboards[0]
+    return bitboard.canonical(bitboards)
+
+
+def _write(path: str, keys: np.ndarray, values: np.ndarray) -> None:
+    '''Writes the pairs sorted by key. The file is replaced atomically'''
+    order = np.argsort(keys, kind='stable')
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(keys)).tobytes())
+        keys[order].tofile(f)
+        values[order].astype(np.float32).tofile(f)
+    # players which mapped the old file keep reading it until they reopen the path
+    os.replace(tmp, path)
+
+
+def save(path: str, q_table: dict[tuple[int, int], float]) -> None:
+    '''Writes a {(state code, move id): value} dict'''
+    n = len(q_table)
+    keys = np.fromiter((state << ACTION_BITS | action for state, action in q_table), dtype=np.uint64, count=n)
+    values = np.fromiter(q_table.values(), dtype=np.float32, count=n)
+    _write(path, keys, values)
+
+
+class QStore:
+    '''
+    Table of the learner: the value of (state code, move id) pairs, at most max_entries of them.
+    Reading a pair which is not stored returns the default and adds nothing. When a new pair does
+    not fit, evict_fraction of the table is dropped: the pairs updated the fewest times first, the
+    least recently used among them. The entries live in preallocated arrays, so a bounded table
+    does not grow after it is full
+    '''
+
+    def __init__(self, max_entries: int | None = None, evict_fraction: float = 1 / 16) -> None:
+        if max_entries is not None and max_entries <= 0:
+            raise ValueError(f'max_entries must be positive, got {max_entries}')
+        if not 0 < evict_fraction <= 1:
+            raise ValueError(f'evict_fraction must be in (0, 1], got {evict_fraction}')
+        self.max_entries = max_entries
+        self.evict_fraction = evict_fraction
+        capacity = max_entries if max_entries is not None else 1 << 16
+        # key -> slot of the arrays
+        self._slots = {}
+        self._keys = np.zeros(capacity, dtype=np.uint64)
+        self._values = np.zeros(capacity, dtype=np.float32)
+        self._visits = np.zeros(capacity, dtype=np.uint32)
+        self._last_used = np.zeros(capacity, dtype=np.uint64)
+        self._free = list(range(capacity - 1, -1, -1))
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def get(self, state: int, action: int, default: float = 0.0) -> float:
+        '''Returns the value of the pair, default if it is not stored'''
+        slot = self._slots.get(state << ACTION_BITS | action)
+        if slot is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._clock += 1
+        self._last_used[slot] = self._clock
+        return float(self._values[slot])
+
+    def set(self, state: int, action: int, value: float) -> None:
+        '''Stores the value of the pair, evicting other pairs if the table is full'''
+        key = state << ACTION_BITS | action
+        slot = self._slots.get(key)
+        if slot is None:
+            if not self._free:
+                self._make_room()
+            slot = self._slots[key] = self._free.pop()
+            self._keys[slot] = key
+            self._visits[slot] = 0
+        self._clock += 1
+        self._values[slot] = value
+        self._visits[slot] += 1
+        self._last_used[slot] = self._clock
+
+    def _make_room(self) -> None:
+        capacity = len(self._keys)
+        if self.max_entries is None:
+            # unbounded: double the arrays
+            for name in ('_keys', '_values', '_visits', '_last_used'):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+            self._free = list(range(2 * capacity - 1, capacity - 1, -1))
+            return
+        # every slot is used: sort by visits, then by last use
+        victims = np.lexsort((self._last_used, self._visits))[:max(1, int(capacity * self.evict_fraction))]
+        for slot, key in zip(victims.tolist(), self._keys[victims].tolist()):
+            del self._slots[key]
+            self._free.append(slot)
+        self.evictions += len(victims)
+
+    def slots(self) -> np.ndarray:
+        '''Returns the slots of the stored pairs'''
+        return np.fromiter(self._slots.values(), dtype=np.intp, count=len(self._slots))
+
+    def save(self, path: str) -> None:
+        '''Writes the table in the binary format'''
+        slots = self.slots()
+        _write(path, self._keys[slots], self._values[slots])
+
+    def to_dict(self) -> dict[tuple[int, int], float]:
+        '''Returns the table as a {(state code, move id): value} dict'''
+        return {(k >> ACTION_BITS, k & _ACTION_MASK): self._values[slot].item() for k, slot in self._slots.items()}
+
+    def stats(self) -> dict:
+        '''Returns the counters of the table'''
+        reads = self.hits + self.misses
+        return {
+            'size': len(self._slots),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / reads if reads else 0.0,
+        }
+
+
+class QTableFile:
+    '''Read-only view of a table written by save'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(_HEADER_SIZE)
+        if len(header) != _HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a Q-table file')
+        n = int(np.frombuffer(header, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+        if n == 0:
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.values = np.zeros(0, dtype=np.float32)
+        else:
+            self.keys = np.memmap(path, dtype=np.uint64, mode='r', offset=_HEADER_SIZE, shape=(n,))
+            self.values = np.memmap(path, dtype=np.float32, mode='r', offset=_HEADER_SIZE + 8 * n, shape=(n,))
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def state_values(self, state: int) -> tuple[np.ndarray, np.ndarray]:
+        '''Returns the move ids stored for the state and their values'''
+        # the entries of a state are contiguous: keys from state << 6 to state << 6 | 63
+        low = np.searchsorted(self.keys, np.uint64(state << ACTION_BITS))
+        high = np.searchsorted(self.keys, np.uint64((state + 1) << ACTION_BITS))
+        return (self.keys[low:high] & np.uint64(_ACTION_MASK)).astype(np.intp), self.values[low:high]
+
+    def get(self, state: int, action: int, default: float = 0.0) -> float:
+        '''Returns the value of the pair, default if it is not stored'''
+        key = np.uint64(state << ACTION_BITS | action)
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.hits += 1
+            return float(self.values[i])
+        self.misses += 1
+        return default
+
+    def move_values(self, bitboards: tuple[int, int], player_id: int | None = None) -> np.ndarray:
+        '''Returns the values of the 44 moves in the position, 0 for the pairs not stored. player_id as in canonical_state'''
+        state, symmetry = canonical_state(bitboards, player_id)
+        values = np.zeros(bitboard.NUM_MOVES, dtype=np.float32)
+        actions, stored = self.state_values(state)
+        # a hit if the position was seen in training
+        if len(actions):
+            self.hits += 1
+        else:
+            self.misses += 1
+        values[actions] = stored
+        return values[MOVE_MAPS[symmetry]]
+
+    def to_dict(self) -> dict[tuple[int, int], float]:
+        '''Returns the table as the {(state code, move id): value} dict used for training'''
+        keys = self.keys.tolist()
+        return {(k >> ACTION_BITS, k & _ACTION_MASK): v for k, v in zip(keys, self.values.tolist())}
+
+    def stats(self) -> dict:
+        '''Returns the counters of the reads, in the format of QStore.stats. The file never changes: no evictions'''
+        reads = self.hits + self.misses
+        return {
+            'size': len(self.keys),
+            'max_entries': len(self.keys),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': 0,
+            'hit_rate': self.hits / reads if reads else 0.0,
+        }
+
+
+# tables already opened in this process: realpath -> (modification time, table). A file rewritten
+# since it was opened is opened again and the old mapping dropped
+_OPENED = {}
+
+
+def load(path: str) -> QTableFile:
+    '''Opens a table, reusing the mapping if the same file was already opened by this process'''
+    realpath = os.path.realpath(path)
+    mtime = os.stat(path).st_mtime_ns
+    opened = _OPENED.get(realpath)
+    if opened is None or opened[0] != mtime:
+        opened = _OPENED[realpath] = (mtime, QTableFile(path))
+    return opened[1]
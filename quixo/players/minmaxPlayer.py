@@ -1,68 +1,297 @@
-from copy import deepcopy
-from game import Game, Move, Player
+import time
+from game import Game, Move, Player, decode_move
+from bitboard import INVERSE_SYMMETRIES, MOVE_SYMMETRIES, NUM_MOVES, unique_moves
+from transposition import EXACT, LOWER, UPPER, SharedTranspositionTable, TranspositionTable, Zobrist
+from evaluation import Evaluator
+from tactics import tactical_move
+import opening_book
+from lazy_smp import LazySMP
+import rollout
 import numpy as np
 
+
+# nodes searched between two checks of the clock
+_CHECK_INTERVAL = 256
+
+
+class _OutOfBudget(Exception):
+    '''Raised inside the search when the time or node budget of the decision is over'''
+
+
 class MinMaxPlayer(Player):
-    def __init__(self, player: int = 0) -> None:
+    def __init__(self, player: int = 0, depth: int = 2, tt_size: int = 1 << 16, tt_policy: str = 'depth',
+                 time_limit: float | None = None, node_limit: int | None = None,
+                 evaluation: str | dict | Evaluator | None = 'default', symmetric_root: bool = True,
+                 book: str | opening_book.OpeningBook | None = None, workers: int = 1,
+                 table: TranspositionTable | SharedTranspositionTable | None = None) -> None:
+        '''
+        The search deepens iteratively up to depth. With time_limit (seconds) or node_limit it stops
+        as soon as the budget is over and plays the best move of the last completed iteration.
+        evaluation scores the leaves which are not over, see evaluation.py (weights, config name or
+        Evaluator); with None they score 0. Moves which reach the same position are searched once,
+        and with symmetric_root the moves of the root which reach symmetric positions too.
+        book (path or OpeningBook) gives the moves of the positions it holds without a search, see opening_book.py.
+        With workers > 1 helper processes search the same root on a transposition table in shared memory,
+        see lazy_smp.py; call close to stop them. table is searched on instead of a new transposition table
+        '''
         super().__init__()
         self.player = player % 2  # Ensure the player is either 0 or 1
+        self.depth = depth
+        self.time_limit = time_limit
+        self.symmetric_root = symmetric_root
+        self.node_limit = node_limit
+        # Results are shared between the decisions of the same player, see transposition.py
+        self.zobrist = Zobrist()
+        if table is not None:
+            self.tt = table
+            self.smp = None
+        elif workers > 1:
+            self.tt = SharedTranspositionTable(tt_size, tt_policy)
+            config = {'depth': depth, 'tt_size': tt_size, 'tt_policy': tt_policy, 'time_limit': time_limit,
+                      'node_limit': node_limit, 'evaluation': evaluation, 'symmetric_root': symmetric_root}
+            self.smp = LazySMP(workers, config, self.tt)
+        else:
+            self.tt = TranspositionTable(tt_size, tt_policy)
+            self.smp = None
+        # set by lazy_smp in the helper processes: the main search is over when _stop[0] is set
+        self._stop = None
+        # Move ordering: two killer moves per ply and a history score per player and move
+        self.killers = [[-1, -1] for _ in range(depth + 1)]
+        self.history = [[0] * NUM_MOVES for _ in range(2)]
+        # depth of the iteration in progress
+        self._search_depth = depth
+        self._nodes = 0
+        # the clock and the stop flag are checked once _nodes reaches _next_check
+        self._next_check = _CHECK_INTERVAL
+        self._deadline = None
+        # depth reached, nodes, time and nodes/sec of the last decision
+        self.search_info = {}
+        # moves searched at the root, None for all of them
+        self._root_moves = None
+        self.book = opening_book.load(book) if isinstance(book, str) else book
+        if evaluation is None or isinstance(evaluation, Evaluator):
+            self.evaluator = evaluation
+        else:
+            self.evaluator = Evaluator(evaluation)
 
     def make_move(self, game: 'Game') -> tuple[tuple[int, int], Move]:
-        # Create a deep copy of the game to explore moves
-        temp_game = deepcopy(game)
-        move = self.minmax(temp_game)
-        print(move)
-        return (move[0], move[1]), move[2]  # Return position and direction of the move
+        if self.book is not None:
+            move = self.book.probe(game._bitboards, game.current_player_idx)
+            if move != -1:
+                self.search_info = {'book': True}
+                return decode_move(move)
+        # A win on the spot, or the only move which does not give the opponent one, needs no search
+        move, candidates = tactical_move(game._bitboards, game.current_player_idx)
+        if move != -1:
+            self.search_info = {'tactic': True}
+            return decode_move(move)
+        # The search pushes and pops moves on the game itself, which is restored when it returns
+        move = self.iterative_deepening(game, candidates)
+        return decode_move(move[0])  # Return position and direction of the move
+
+    def iterative_deepening(self, game: 'Game', root_moves: list[int] | None = None) -> list:
+        '''
+        Searches with increasing depth until the budget is over, returns [move id, score] of the last completed iteration.
+        root_moves restricts the moves searched at the root (see tactics.py)
+        '''
+        start = time.perf_counter()
+        self._prepare(game, root_moves, start)
+        self.tt.new_search()
+        if self.smp is not None:
+            self.smp.start(game._bitboards, self.player, root_moves)
+        best, reached = self._deepen(game, 1)
+        nodes = self._nodes
+        if self.smp is not None:
+            # Lazy SMP: the deepest iteration completed by any process
+            for helper_best, helper_reached, helper_nodes in self.smp.finish():
+                nodes += helper_nodes
+                if helper_reached > reached:
+                    best, reached = helper_best, helper_reached
+
+        elapsed = time.perf_counter() - start
+        self.search_info = {
+            'depth': reached,
+            'nodes': nodes,
+            'time': elapsed,
+            'nps': nodes / elapsed if elapsed > 0 else 0.0,
+        }
+        self._search_depth = self.depth
+        self._deadline = None
+        return best
+
+    def helper_search(self, game: 'Game', root_moves: list[int] | None, first_depth: int) -> tuple[list | None, int, int]:
+        '''
+        Search of a Lazy SMP helper, see lazy_smp.py: deepens from first_depth on the shared table until the
+        budget is over or the main search stops it. Returns ([move id, score] or None, depth completed, nodes)
+        '''
+        # the main search owns the table: no clear, no new generation
+        self.player = game.current_player_idx
+        self._prepare(game, root_moves, time.perf_counter())
+        best, reached = self._deepen(game, first_depth)
+        self._search_depth = self.depth
+        self._deadline = None
+        return best, reached, self._nodes
+
+    def _prepare(self, game: 'Game', root_moves: list[int] | None, start: float) -> None:
+        self._root_moves = set(root_moves) if root_moves else None
+        # Scores are from the point of view of self.player, stored ones are useless for the other seat
+        if game.current_player_idx != self.player:
+            self.player = game.current_player_idx
+            self.tt.clear()
+        self._deadline = start + self.time_limit if self.time_limit is not None else None
+        self._nodes = 0
+        self._next_check = _CHECK_INTERVAL
+        # killers refer to the plies of the previous decision, the history is kept
+        self.killers = [[-1, -1] for _ in range(self.depth + 1)]
 
-    def minmax(self, game: 'Game', depth: int = 0, alpha: float = -np.inf, beta: float = np.inf) -> tuple[tuple[int, int], Move, int]:
+    def _deepen(self, game: 'Game', first_depth: int) -> tuple[list | None, int]:
+        '''Iterative deepening from first_depth, returns the result of the last completed iteration and its depth'''
+        undo_size = len(game._undo)
+        best, reached = None, 0
+        for depth in range(first_depth, self.depth + 1):
+            self._search_depth = depth
+            try:
+                result = self.minmax(game)
+            except _OutOfBudget:
+                # The interrupted iteration left its moves on the game
+                while len(game._undo) > undo_size:
+                    game.pop()
+                break
+            best, reached = result, depth
+            # A forced win or loss does not change with more depth
+            if abs(result[1]) == 1:
+                break
+        return best, reached
+
+    def _check_budget(self) -> None:
+        # the first iteration always completes, so that there is a move to play
+        if self._search_depth == 1:
+            return
+        if self.node_limit is not None and self._nodes >= self.node_limit:
+            raise _OutOfBudget
+        # the leaves scored in a batch advance _nodes by many at once
+        if self._nodes >= self._next_check:
+            self._next_check = self._nodes + _CHECK_INTERVAL
+            if self._deadline is not None and time.perf_counter() >= self._deadline:
+                raise _OutOfBudget
+            if self._stop is not None and self._stop[0]:
+                raise _OutOfBudget
+
+    def order_moves(self, moves: tuple[int, ...], player_id: int, ply: int, tt_move: int) -> list[int]:
+        '''Best move stored for the position first (the principal variation of the previous iteration), then killers, then by history'''
+        history = self.history[player_id]
+        ordered = sorted(moves, key=history.__getitem__, reverse=True)
+        first = [tt_move] if tt_move in moves else []
+        if ply < len(self.killers):
+            first += [k for k in self.killers[ply] if k != tt_move and k in moves]
+        if first:
+            ordered = first + [move for move in ordered if move not in first]
+        return ordered
+
+    def minmax(self, game: 'Game', depth: int = 0, alpha: float = -np.inf, beta: float = np.inf, key: int | None = None) -> list:
+        '''Returns [move id, score] of the best move for the player to move. key is the Zobrist hash of the position'''
+        self._nodes += 1
+        self._check_budget()
         player_id = game.current_player_idx
-        possible_moves = game.available_moves(player_id)
+        possible_moves = game.legal_moves(player_id)
 
         # Initialize the best score information for the current player
-        best_score_info = [-1, -1, -1, -np.inf] if player_id == self.player else [-1, -1, -1, np.inf]
+        best_score_info = [-1, -np.inf] if player_id == self.player else [-1, np.inf]
 
         # Termination conditions
-        if game.check_winner() != -1 or depth >= 2 or not possible_moves:
-            return [-1, -1, -1, self.calculate_score(game)]
+        if game.check_winner() != -1 or depth >= self._search_depth or not possible_moves:
+            return [-1, self.calculate_score(game)]
 
-        for move in possible_moves:
-            position, slide = move
-            # Save the current board state
-            temp_board_state = deepcopy(game._board[position[1], :] if slide in {Move.LEFT, Move.RIGHT} else game._board[:, position[0]])
+        if key is None:
+            key = self.zobrist.hash(game._bitboards, player_id)
+        # Symmetric positions share the same entry, moves are stored in the frame of the canonical one
+        canonical_key, symmetry = self.zobrist.canonical(key)
+        remaining = self._search_depth - depth
+        entry = self.tt.probe(canonical_key)
+        tt_move = -1
+        if entry is not None:
+            tt_depth, bound, score, tt_move = entry
+            tt_move = MOVE_SYMMETRIES[INVERSE_SYMMETRIES[symmetry]][tt_move]
+            # The root always searches, to return a move of this very game
+            if depth > 0 and tt_depth >= remaining and (
+                bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha)
+            ):
+                return [tt_move, score]
 
-            # Execute the move
-            game.execute_move(position, slide, player_id)
-            reward = self.minmax(game, depth + 1, alpha, beta)
+        alpha_orig, beta_orig = alpha, beta
+        # One move per distinct child position
+        children = unique_moves(game._bitboards, player_id, depth == 0 and self.symmetric_root)
+        if depth == 0 and self._root_moves is not None:
+            children = [move for move in children if move in self._root_moves] or children
+        ordered = self.order_moves(children, player_id, depth, tt_move)
+        if remaining == 1 and self.evaluator is not None:
+            # The children are leaves: all of them in one batch
+            best_score_info = self.score_children(game, ordered)
+            ordered = []
+        for move in ordered:
+            # Execute the move, then undo it
+            old_bitboards = game._bitboards
+            game.push(move)
+            reward = self.minmax(game, depth + 1, alpha, beta, self.zobrist.update(key, old_bitboards, game._bitboards, move))
+            game.pop()
 
-            # Restore the board state
-            if slide in {Move.LEFT, Move.RIGHT}:
-                game._board[position[1]] = temp_board_state
-            else:
-                game._board[:, position[0]] = temp_board_state
-
-            reward[0], reward[1], reward[2] = position[0], position[1], slide  # Update position and slide
+            reward[0] = move  # Update the move
 
             # Update the best score for Max or Min player
             if player_id == self.player:
-                if reward[3] > best_score_info[3]:  # Max player
+                if reward[1] > best_score_info[1]:  # Max player
                     best_score_info = reward
-                    alpha = reward[3]
+                    alpha = max(alpha, reward[1])
             else:
-                if reward[3] < best_score_info[3]:  # Min player
+                if reward[1] < best_score_info[1]:  # Min player
                     best_score_info = reward
-                    beta = reward[3]
+                    beta = min(beta, reward[1])
 
             # Pruning
             if alpha >= beta:
+                # Remember the move which caused the cutoff
+                killers = self.killers[depth]
+                if killers[0] != move:
+                    killers[0], killers[1] = move, killers[0]
+                self.history[player_id][move] += remaining * remaining
                 break
 
+        score = best_score_info[1]
+        bound = UPPER if score <= alpha_orig else LOWER if score >= beta_orig else EXACT
+        self.tt.store(canonical_key, remaining, bound, score, MOVE_SYMMETRIES[symmetry][best_score_info[0]])
         return best_score_info
 
-    def calculate_score(self, game: 'Game') -> int:
+    def score_children(self, game: 'Game', moves: list[int]) -> list:
+        '''Returns [move id, score] of the best of the moves, scoring the positions they reach with one batch'''
+        self._nodes += len(moves)
+        player_id = game.current_player_idx
+        n = len(moves)
+        b0 = np.full(n, game._bitboards[0], dtype=np.int64)
+        b1 = np.full(n, game._bitboards[1], dtype=np.int64)
+        b0, b1 = rollout.apply_moves(b0, b1, np.full(n, player_id, dtype=np.int64), np.array(moves))
+        to_move = np.full(n, 1 - player_id, dtype=np.int64)
+        winners = rollout.winners(b0, b1, to_move)
+        scores = self.evaluator.evaluate_batch(b0, b1, self.player, to_move)
+        scores = np.where(winners == -1, scores, np.where(winners == self.player, 1.0, -1.0))
+        # the first of the best in the order of the moves
+        best = int(scores.argmax() if player_id == self.player else scores.argmin())
+        return [moves[best], float(scores[best])]
+
+    def calculate_score(self, game: 'Game') -> float:
         winner = game.check_winner()
         if winner == self.player:
             return 1  # Win
         elif winner == -1:
+            if self.evaluator is not None:
+                # Position not over: heuristic score in (-1, 1)
+                return self.evaluator.evaluate(game._bitboards, self.player, game.current_player_idx)
             return 0  # Draw
         else:
             return -1  # Lose
+
+    def close(self) -> None:
+        '''Stops the helper processes of the parallel search and releases the shared table, if any'''
+        if self.smp is not None:
+            self.smp.close()
+            self.smp = None
+            self.tt.close()
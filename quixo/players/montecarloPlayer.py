@@ -1,46 +1,70 @@
+import math
 import random
-from game import Game, Move, Player
-import copy  
+from game import Game, Move, Player, decode_move
+from mcts import MCTS
+from parallel_mcts import RootParallelMCTS
+from tactics import tactical_move
+import opening_book
 
 class MonteCarloPlayer(Player):
-    def __init__(self) -> None:
+    def __init__(self, iterations: int | None = 2000, time_limit: float | None = None, exploration: float = math.sqrt(2),
+                 reuse_tree: bool = True, seed: int | None = None, rollouts_per_leaf: int = 1, workers: int = 1,
+                 book: str | opening_book.OpeningBook | None = None) -> None:
+        '''
+        UCT search, see mcts.py. Each decision runs iterations simulations or stops after time_limit seconds,
+        whichever comes first. With reuse_tree the subtree of the position reached is kept for the next decision.
+        With rollouts_per_leaf > 1 every simulation plays that many random games at once with NumPy, see rollout.py.
+        With workers > 1 every worker process searches its own tree and the statistics of the root are merged,
+        see parallel_mcts.py; the trees are not reused in that case.
+        book (path or OpeningBook) gives the moves of the positions it holds without simulations, see opening_book.py.
+        '''
         super().__init__()
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.reuse_tree = reuse_tree
+        self.tree = MCTS(exploration=exploration, rng=random.Random(seed), rollouts_per_leaf=rollouts_per_leaf)
+        self.parallel = RootParallelMCTS(workers, exploration, rollouts_per_leaf, seed) if workers > 1 else None
+        self.book = opening_book.load(book) if isinstance(book, str) else book
+        # simulations run and nodes of the tree for the last decision, see observers.py
+        self.search_info = {}
 
     def make_move(self, game: 'Game') -> tuple[tuple[int, int], Move]:
         return self.monte_carlo_move(game)
 
     def monte_carlo_move(self, game: 'Game') -> tuple[tuple[int, int], Move]:
-        num_simulations = 1000  
-        num_selected_moves = min(len(game.available_moves(game.get_current_player())), 40)
-        best_move = None
-        best_score = float('-inf')
-        best_from_pos = None  
+        player = game.get_current_player()
+        if self.book is not None:
+            move = self.book.probe(game._bitboards, player)
+            if move != -1:
+                self.search_info = {'book': True}
+                return decode_move(move)
+        # A win on the spot, or the only move which does not give the opponent one: no simulations
+        move, candidates = tactical_move(game._bitboards, player)
+        if move != -1:
+            self.search_info = {'tactic': True}
+            return decode_move(move)
+        if self.parallel is not None:
+            simulations = self.parallel.simulations
+            self.parallel.search(game._bitboards, player, self.iterations, self.time_limit, candidates)
+            self.search_info = {'simulations': self.parallel.simulations - simulations, 'workers': self.parallel.workers}
+            best_move = self.parallel.best_move()
+            return decode_move(best_move) if best_move != -1 else ((0, 0), Move.RIGHT)
+        reused = False
+        if self.reuse_tree:
+            reused = self.tree.set_root(game._bitboards, player)
+        else:
+            self.tree.reset(game._bitboards, player)
+        # the moves which let the opponent win at once are not searched
+        self.tree.restrict_root(candidates)
+        simulations = self.tree.search(self.iterations, self.time_limit)
+        self.search_info = {'simulations': simulations, 'nodes': len(self.tree), 'reused': reused}
+        best_move = self.tree.best_move()
 
-        for move in random.sample(game.available_moves(game.get_current_player()), num_selected_moves):
-            total_score = 0
-                        
-            for _ in range(num_simulations):
-                cloned_game = game
-                cloned_game.execute_move(move[0], move[1], game.get_current_player())
-                
-                while True:
-                    winner = cloned_game.check_winner()
-                    if winner != -1:
-                        break
-                    
-                    random_move = random.choice(cloned_game.available_moves(cloned_game.get_current_player()))
-                    cloned_game.execute_move(random_move[0], random_move[1], cloned_game.get_current_player())
-                
-                if winner == 0:
-                    total_score += 1
-                elif winner == 1:
-                    total_score -= 1
+        if best_move == -1:
+            return (0, 0), Move.RIGHT
+        return decode_move(best_move)
 
-            if total_score > best_score:
-                best_score = total_score
-                best_move = move[1]
-                best_from_pos = move[0]  
-
-        if best_from_pos is None:
-            best_from_pos = (0,0)
-        return best_from_pos, best_move  
\ No newline at end of file
+    def close(self) -> None:
+        '''Stops the worker processes of the parallel search, if any'''
+        if self.parallel is not None:
+            self.parallel.close()
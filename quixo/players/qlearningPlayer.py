@@ -1,50 +1,68 @@
-import random
-from game import Game, Move, Player
-from copy import deepcopy
+import os
+from game import Game, Move, Player, decode_move
+from tactics import tactical_move
+from players.impl import linearq, qtable
 import numpy as np
-import struct
+
+# directory of the tables written by players/impl/qlearning.py
+TABLE_DIR = os.path.join(os.path.dirname(__file__), 'impl')
 
 class QLearningPlayer(Player):
-    def __init__(self, player) -> None:
+    def __init__(self, player, path: str | None = None, swap_players: bool = False) -> None:
+        '''swap_players reads a table trained for both seats (Q_table.bin), see qtable.canonical_state'''
         super().__init__()
-        self.q_table= {}
         self.player=player
-        file = "players/impl/Q_table0.txt" if self.player==0 else "players/impl/Q_table1.txt"
-        
-        with open(file, 'r') as f:
-            for line in f:
-                line = line.split(" ")
-                self.q_table[(line[0], line[1])] = float(line[2])
+        self.swap_players = swap_players
+        name = "Q_table.bin" if swap_players else f"Q_table{self.player}.bin"
+        file = path if path is not None else os.path.join(TABLE_DIR, name)
+        # memory-mapped, shared with the other players which use the same file
+        self.q_table = qtable.load(file)
+        # whether the position of the last decision was in the table, see observers.py
+        self.search_info = {}
 
     def get_q_table(self):
         return self.q_table
 
-    def compact_string(self, matrix):
-        matrix = matrix.flatten()
-        compressed_data = struct.pack(f">{len(matrix)}b", *matrix)
-              
-        return compressed_data
-    
-    def compact_move(self,t):
-        string=str(t[0][0])+str(t[0][1])+str(t[1].value)
-        string = string.encode('utf-8')
-        return string
-    
-    def decode_move(self,t):
-        t = t.decode('utf-8')
-        return (int(t[0]), int(t[1])), Move(int(t[2]))
+    def compact_state(self, bitboards):
+        # (canonical state code, symmetry which moves the actions to its frame)
+        return qtable.canonical_state(bitboards, self.player if self.swap_players else None)
     
     def get_q_value(self, state, action):
-        if (state, action) not in self.q_table:
-            self.q_table[(state, action)] = 0
-        return self.q_table[(state, action)]
+        return self.q_table.get(state, action)
     
     def make_move(self, game: 'Game') -> tuple[tuple[int, int], Move]:
         player = game.get_current_player()
-        actions = game.possible_moves(player)
-        state = game.get_board()
-        state = self.compact_string(state)
-        actions = [self.compact_move(action) for action in actions]
-        q_values = np.array([self.get_q_value(state, action) for action in actions])
+        move, candidates = tactical_move(game._bitboards, player)
+        if move != -1:
+            self.search_info = {'tactic': True}
+            return decode_move(move)
+        # one move per distinct position reached, as in training, without the ones which let the opponent win
+        actions = np.array(candidates)
+        # unseen pairs are worth 0
+        hits = self.q_table.hits
+        q_values = self.q_table.move_values(game._bitboards, player if self.swap_players else None)[actions]
+        self.search_info = {'candidates': len(actions), 'table_hits': self.q_table.hits - hits}
+        maximum = np.max(q_values)
+        return decode_move(actions[np.random.choice(np.where(q_values == maximum)[0])])
+
+
+class LinearQLearningPlayer(Player):
+    def __init__(self, player, path: str | None = None) -> None:
+        '''Plays the best move for the linear Q-function trained with --linear, see players/impl/linearq.py'''
+        super().__init__()
+        self.player=player
+        self.q_function = linearq.LinearQ.load(path if path is not None else os.path.join(TABLE_DIR, "Q_linear.npy"))
+        self.search_info = {}
+
+    def make_move(self, game: 'Game') -> tuple[tuple[int, int], Move]:
+        player = game.get_current_player()
+        move, candidates = tactical_move(game._bitboards, player)
+        if move != -1:
+            self.search_info = {'tactic': True}
+            return decode_move(move)
+        actions = np.array(candidates)
+        self.search_info = {'candidates': len(actions)}
+        # all the candidate moves in one batch
+        q_values = self.q_function.q_values(game._bitboards, player, actions)
         maximum = np.max(q_values)
-        return self.decode_move(actions[np.random.choice(np.where(q_values == maximum)[0])])
\ No newline at end of file
+        return decode_move(actions[np.random.choice(np.where(q_values == maximum)[0])])
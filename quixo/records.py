@@ -0,0 +1,233 @@
+'''
+Compact binary records of played games, and a reader which replays them in batches.
+
+A game starts from the empty board and is stored as one byte per turn, the move id played
+(see bitboard.MOVES), PASS for a turn in which every attempt of the player was rejected. The
+records are appended to chunks of games_per_chunk games, each chunk a pair of files:
+
+    <prefix>-<chunk>.moves   the move ids of the games, one after the other (uint8)
+    <prefix>-<chunk>.games   magic (8 bytes) | one GAME_DTYPE entry per game
+
+A game entry holds the offset of its moves in the .moves file, their number, the seed the game
+was played with (-1 if unknown), the winner (-1 for a draw) and the player who moved first.
+The moves of a game are written before its entry, so a chunk cut short by a crash only misses
+its last games.
+
+GameDataset maps the chunks with np.memmap and rebuilds the positions of many games at once,
+one ply per array operation (see rollout.apply_moves): no game is unpacked in Python.
+
+    with GameRecordWriter('records') as writer:
+        writer.seed = seed
+        game.play(player0, player1, observers=[writer])
+    for batch in GameDataset('records').positions(4096, shuffle=True, seed=0):
+        batch['b0'], batch['b1'], batch['player'], batch['move'], batch['target']
+'''
+import glob
+import os
+
+import numpy as np
+
+import rollout
+from observers import Observer
+
+MAGIC = b'QXGAME01'
+# move id of a turn with no move
+PASS = 255
+GAME_DTYPE = np.dtype([
+    ('offset', '<u8'),
+    ('length', '<u4'),
+    ('seed', '<i8'),
+    ('winner', 'i1'),
+    ('first_player', 'i1'),
+])
+
+
+def _chunk_paths(directory: str, prefix: str) -> list[str]:
+    '''Returns the paths of the chunks without extension, in order'''
+    return sorted(path[:-len('.games')] for path in glob.glob(os.path.join(directory, glob.escape(prefix) + '-*.games')))
+
+
+class MoveRecorder(Observer):
+    '''Collects the move ids of the game being played by Game.play'''
+
+    def __init__(self) -> None:
+        self.moves = []
+        self.first_player = 0
+
+    def game_start(self, game, players: list) -> None:
+        if game._bitboards != (0, 0):
+            raise ValueError('only the games which start from the empty board can be recorded')
+        self.moves = []
+        # play passes the turn before every move
+        self.first_player = (game.current_player_idx + 1) % 2
+
+    def after_move(self, event: dict) -> None:
+        self.moves.append(event['move'] if event['move'] != -1 else PASS)
+
+
+class GameRecordWriter(MoveRecorder):
+    '''
+    Appends games to the chunks <prefix>-NNNNN in directory, starting a new chunk after the existing ones.
+    As an observer of Game.play it records every game played, with seed as its seed
+    '''
+
+    def __init__(self, directory: str, prefix: str = 'games', games_per_chunk: int = 1 << 16,
+                 buffer_games: int = 1024) -> None:
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.games_per_chunk = games_per_chunk
+        self.buffer_games = buffer_games
+        # seed of the next game recorded as an observer
+        self.seed = -1
+        existing = _chunk_paths(directory, prefix)
+        self._chunk = int(existing[-1].rsplit('-', 1)[1]) + 1 if existing else 0
+        self._chunk_games = 0
+        self._chunk_moves = 0
+        self._entries = []
+        self._moves = bytearray()
+        self.games = 0
+
+    def game_end(self, game, winner: int) -> None:
+        self.append(self.moves, winner, self.seed, self.first_player)
+
+    def append(self, moves, winner: int, seed: int = -1, first_player: int = 0) -> None:
+        '''Records a game from the empty board: its move ids (PASS for a turn without a move), winner, seed'''
+        self._entries.append((self._chunk_moves, len(moves), seed, winner, first_player))
+        self._moves += bytes(moves)
+        self._chunk_moves += len(moves)
+        self._chunk_games += 1
+        self.games += 1
+        if self._chunk_games == self.games_per_chunk or len(self._entries) >= self.buffer_games:
+            self.flush()
+
+    def flush(self) -> None:
+        '''Writes the buffered games'''
+        if self._entries:
+            path = os.path.join(self.directory, f'{self.prefix}-{self._chunk:05d}')
+            with open(path + '.moves', 'ab') as f:
+                f.write(self._moves)
+            new = not os.path.exists(path + '.games')
+            with open(path + '.games', 'ab') as f:
+                if new:
+                    f.write(MAGIC)
+                f.write(np.array(self._entries, dtype=GAME_DTYPE).tobytes())
+            self._entries = []
+            self._moves = bytearray()
+        if self._chunk_games == self.games_per_chunk:
+            self._chunk += 1
+            self._chunk_games = 0
+            self._chunk_moves = 0
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> 'GameRecordWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class GameDataset:
+    '''Read-only view of the games written by GameRecordWriter, the chunks are memory-mapped'''
+
+    def __init__(self, directory: str, prefix: str = 'games') -> None:
+        self.chunks = []
+        for path in _chunk_paths(directory, prefix):
+            with open(path + '.games', 'rb') as f:
+                if f.read(len(MAGIC)) != MAGIC:
+                    raise ValueError(f'{path}.games is not a game record file')
+            n = (os.path.getsize(path + '.games') - len(MAGIC)) // GAME_DTYPE.itemsize
+            if n == 0:
+                continue
+            games = np.memmap(path + '.games', dtype=GAME_DTYPE, mode='r', offset=len(MAGIC), shape=(n,))
+            if os.path.getsize(path + '.moves'):
+                moves = np.memmap(path + '.moves', dtype=np.uint8, mode='r')
+            else:
+                moves = np.zeros(0, dtype=np.uint8)
+            self.chunks.append((games, moves))
+        # index of the first game of each chunk
+        self._starts = np.cumsum([0] + [len(games) for games, _ in self.chunks])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def game(self, index: int) -> tuple[np.ndarray, int, int, int]:
+        '''Returns (move ids, winner, seed, first player) of a game'''
+        chunk = int(np.searchsorted(self._starts, index, side='right')) - 1
+        games, moves = self.chunks[chunk]
+        entry = games[index - self._starts[chunk]]
+        offset = int(entry['offset'])
+        return (np.array(moves[offset:offset + int(entry['length'])]), int(entry['winner']), int(entry['seed']),
+                int(entry['first_player']))
+
+    def entries(self) -> np.ndarray:
+        '''Returns the GAME_DTYPE entries of all the games (offsets are relative to their chunk)'''
+        if not self.chunks:
+            return np.zeros(0, dtype=GAME_DTYPE)
+        return np.concatenate([np.asarray(games) for games, _ in self.chunks])
+
+    def _replay(self, games: np.ndarray, moves: np.ndarray) -> dict[str, np.ndarray]:
+        '''Positions before every move of the games of one chunk, replayed together'''
+        lengths = games['length'].astype(np.int64)
+        steps = int(lengths.max())
+        # (G, steps) move ids, only the first length of each row are used
+        index = games['offset'].astype(np.int64)[:, None] + np.arange(steps)
+        played = np.arange(steps) < lengths[:, None]
+        padded = np.asarray(moves[np.where(played, index, 0)]).astype(np.intp) if steps else index
+        b0 = np.zeros(len(games), dtype=np.int64)
+        b1 = np.zeros(len(games), dtype=np.int64)
+        player = games['first_player'].astype(np.int64)
+        winner = games['winner'].astype(np.int64)
+        out = {'b0': [b0[:0]], 'b1': [b1[:0]], 'player': [player[:0]], 'move': [np.zeros(0, dtype=np.intp)],
+               'target': [np.zeros(0, dtype=np.float32)]}
+        for ply in range(steps):
+            active = played[:, ply]
+            move = padded[:, ply]
+            real = active & (move != PASS)
+            out['b0'].append(b0[real])
+            out['b1'].append(b1[real])
+            out['player'].append(player[real])
+            out['move'].append(move[real])
+            # result for the player to move: 1 win, -1 loss, 0 draw
+            w = winner[real]
+            out['target'].append(np.where(w == -1, 0, np.where(w == player[real], 1, -1)).astype(np.float32))
+            new_b0, new_b1 = rollout.apply_moves(b0, b1, player, np.where(real, move, 0))
+            b0 = np.where(real, new_b0, b0)
+            b1 = np.where(real, new_b1, b1)
+            player = np.where(active, 1 - player, player)
+        return {name: np.concatenate(parts) for name, parts in out.items()}
+
+    def positions(self, batch_size: int = 4096, shuffle: bool = False, seed: int | None = None, games_per_replay: int = 4096):
+        '''
+        Yields batches of batch_size positions (the last one may be shorter), dicts of arrays:
+        b0, b1 the bitboards, player the player to move, move the move id played there and target
+        the result of the game for the player to move (1, -1, 0 for a draw).
+        games_per_replay games are replayed together; with shuffle their order and the positions are shuffled
+        '''
+        rng = np.random.default_rng(seed)
+        groups = [(c, start) for c, (games, _) in enumerate(self.chunks) for start in range(0, len(games), games_per_replay)]
+        if shuffle:
+            rng.shuffle(groups)
+        pending = []
+        size = 0
+        for c, start in groups:
+            games, moves = self.chunks[c]
+            batch = self._replay(np.asarray(games[start:start + games_per_replay]), moves)
+            if shuffle:
+                order = rng.permutation(len(batch['move']))
+                batch = {name: values[order] for name, values in batch.items()}
+            pending.append(batch)
+            size += len(batch['move'])
+            if size >= batch_size:
+                merged = {name: np.concatenate([b[name] for b in pending]) for name in batch}
+                for i in range(0, size - batch_size + 1, batch_size):
+                    yield {name: values[i:i + batch_size] for name, values in merged.items()}
+                rest = size % batch_size
+                pending = [{name: values[size - rest:] for name, values in merged.items()}] if rest else []
+                size = rest
+        if size:
+            yield {name: np.concatenate([b[name] for b in pending]) for name in pending[0]}
+
@@ -0,0 +1,96 @@
+'''
+Batched random playouts with NumPy.
+
+Many games are stored as two int64 arrays of bitboards (see bitboard.py) and advanced one ply
+per step with array operations: legal moves, random choice, slide and win detection are computed
+for all the games at once, and the finished ones are dropped from the arrays.
+'''
+import numpy as np
+
+import bitboard
+
+# per move id: cells kept, cells shifted and by how much, destination of the taken cube
+_KEEP = np.array([spec[0] for spec in bitboard.MOVE_SPECS], dtype=np.int64)
+_SRC = np.array([spec[1] for spec in bitboard.MOVE_SPECS], dtype=np.int64)
+_LSHIFT = np.array([spec[2] for spec in bitboard.MOVE_SPECS], dtype=np.int64)
+_RSHIFT = np.array([spec[3] for spec in bitboard.MOVE_SPECS], dtype=np.int64)
+_DEST = np.array([spec[4] for spec in bitboard.MOVE_SPECS], dtype=np.int64)
+# bit index of the cell taken by each move
+_MOVE_CELL_INDEX = np.array([r * bitboard.SIZE + c for r, c, _ in bitboard.MOVES], dtype=np.int64)
+
+
+def legal_mask(b0: np.ndarray, b1: np.ndarray, player: np.ndarray) -> np.ndarray:
+    '''Returns the (N, 44) boolean mask of the legal moves of the player to move in each game'''
+    opponent = np.where(player == 0, b1, b0)
+    return (opponent[:, None] >> _MOVE_CELL_INDEX) & 1 == 0
+
+
+def apply_moves(b0: np.ndarray, b1: np.ndarray, player: np.ndarray, moves: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Returns the bitboards after each game played its move id. The moves are not checked'''
+    keep, src, lshift, rshift, dest = _KEEP[moves], _SRC[moves], _LSHIFT[moves], _RSHIFT[moves], _DEST[moves]
+    b0 = (b0 & keep) | (((b0 & src) << lshift) >> rshift)
+    b1 = (b1 & keep) | (((b1 & src) << lshift) >> rshift)
+    # the taken piece always shows the symbol of the player
+    return np.where(player == 0, b0 | dest, b0), np.where(player == 1, b1 | dest, b1)
+
+
+def has_lines(boards: np.ndarray) -> np.ndarray:
+    '''Returns which of the bitboards of one player hold a complete line'''
+    rows = boards & boards >> 1 & boards >> 2 & boards >> 3 & boards >> 4 & bitboard.COL_MASKS[0]
+    cols = boards & boards >> 5 & boards >> 10 & boards >> 15 & boards >> 20
+    diag = (boards & bitboard.DIAG_MASK) == bitboard.DIAG_MASK
+    anti_diag = (boards & bitboard.ANTI_DIAG_MASK) == bitboard.ANTI_DIAG_MASK
+    return (rows != 0) | (cols != 0) | diag | anti_diag
+
+
+def winners(b0: np.ndarray, b1: np.ndarray, player: np.ndarray) -> np.ndarray:
+    '''Returns the winner of each game with player to move, -1 if it is not over. Same rule as bitboard.winner'''
+    line0 = has_lines(b0)
+    line1 = has_lines(b1)
+    return np.where(line1, np.where(line0, player, 1), np.where(line0, 0, -1))
+
+
+def simulate(b0: np.ndarray, b1: np.ndarray, player: np.ndarray, rng: np.random.Generator, max_plies: int = 200) -> np.ndarray:
+    '''
+    Plays random moves in all the games until they are over. Returns the winner of each game,
+    -1 for the games still open after max_plies
+    '''
+    b0 = np.asarray(b0, dtype=np.int64)
+    b1 = np.asarray(b1, dtype=np.int64)
+    player = np.asarray(player, dtype=np.int64)
+    result = np.full(len(b0), -1, dtype=np.int64)
+    # indices of the games still running
+    active = np.arange(len(b0))
+    for _ in range(max_plies):
+        w = winners(b0, b1, player)
+        done = w != -1
+        if done.any():
+            result[active[done]] = w[done]
+            running = ~done
+            active, b0, b1, player = active[running], b0[running], b1[running], player[running]
+        if len(active) == 0:
+            return result
+        # uniform choice among the legal moves: the legal move with the highest random key
+        keys = rng.random((len(active), bitboard.NUM_MOVES))
+        keys[~legal_mask(b0, b1, player)] = -1.0
+        b0, b1 = apply_moves(b0, b1, player, keys.argmax(axis=1))
+        player = 1 - player
+    result[active] = winners(b0, b1, player)
+    return result
+
+
+def playouts(bitboards: tuple[int, int], player_id: int, count: int, rng: np.random.Generator | None = None,
+             max_plies: int = 200, batch_size: int = 4096) -> np.ndarray:
+    '''
+    Runs count random games from the position with player_id to move.
+    Returns [wins of player 0, wins of player 1, draws]
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    counts = np.zeros(3, dtype=np.int64)
+    while count > 0:
+        n = min(count, batch_size)
+        result = simulate(np.full(n, bitboards[0]), np.full(n, bitboards[1]), np.full(n, player_id), rng, max_plies)
+        # index 2 for the draws
+        counts += np.bincount(np.where(result == -1, 2, result), minlength=3)
+        count -= n
+    return counts
@@ -0,0 +1,75 @@
+'''
+One-move tactics: immediate wins and the opponent's immediate wins.
+
+A move can complete only a line it changes (bitboard.MOVE_LINES), and that line must already
+hold 4 pieces of the mover: the slid line keeps its other 4 cubes, a crossing line changes in a
+single cell. So the moves are tried only when the mover has a line with 4 pieces, and only the
+ones which change such a line: in most positions the answer costs a dozen bit operations.
+
+The players ask tactical_move before searching: a winning move, or the only move which does not
+give the opponent a win, is played at once, and the search only considers the safe moves.
+'''
+import bitboard
+
+_NEAR = bitboard.SIZE - 1
+
+
+def _near_lines(board: int) -> list[int]:
+    '''Returns the masks of the lines where the board has at least 4 pieces'''
+    return [mask for mask in bitboard.LINE_MASKS if (board & mask).bit_count() >= _NEAR]
+
+
+def winning_moves(bitboards: tuple[int, int], player_id: int) -> list[int]:
+    '''Returns the ids of the moves which win at once for player_id (as if player_id were to move)'''
+    near = _near_lines(bitboards[player_id])
+    if not near:
+        return []
+    apply_move, winner_after, move_lines = bitboard.apply_move, bitboard.winner_after, bitboard.MOVE_LINES
+    moves = []
+    for move_id in bitboard.legal_moves(bitboards, player_id):
+        lines = move_lines[move_id]
+        if any(mask in lines for mask in near):
+            if winner_after(apply_move(bitboards, move_id, player_id), move_id, 1 - player_id) == player_id:
+                moves.append(move_id)
+    return moves
+
+
+def has_winning_move(bitboards: tuple[int, int], player_id: int) -> bool:
+    '''Returns True if player_id could win with one move'''
+    return bool(winning_moves(bitboards, player_id))
+
+
+def safe_moves(bitboards: tuple[int, int], player_id: int) -> list[int]:
+    '''
+    Returns the moves of player_id, one per distinct position reached (see bitboard.successors),
+    after which the opponent cannot win with one move. They include the winning moves
+    '''
+    opponent = 1 - player_id
+    safe = []
+    for move_id, child in bitboard.successors(bitboards, player_id):
+        result = bitboard.winner_after(child, move_id, opponent)
+        if result == player_id or (result == -1 and not has_winning_move(child, opponent)):
+            safe.append(move_id)
+    return safe
+
+
+def forced_loss(bitboards: tuple[int, int], player_id: int) -> bool:
+    '''Returns True if every move of player_id loses at once or lets the opponent win with the next move'''
+    return not safe_moves(bitboards, player_id)
+
+
+def tactical_move(bitboards: tuple[int, int], player_id: int) -> tuple[int, list[int]]:
+    '''
+    Returns (move, candidates) for player_id to move. move is a winning move, or the only move which
+    does not let the opponent win, -1 if the position needs a search. candidates are the moves worth
+    searching: the safe ones, or all the distinct moves when the position is a forced loss
+    '''
+    wins = winning_moves(bitboards, player_id)
+    if wins:
+        return wins[0], wins
+    safe = safe_moves(bitboards, player_id)
+    if len(safe) == 1:
+        return safe[0], safe
+    if not safe:
+        return -1, bitboard.unique_moves(bitboards, player_id)
+    return -1, safe
@@ -0,0 +1,255 @@
+'''
+Tournaments between players on a process pool.
+
+A roster is a list of entrants: a Player class, or a (name, class, kwargs) tuple. Every pairing
+plays games_per_pair games, alternating the seats, and every game gets its own seed derived from
+the tournament seed, so a tournament can be replayed exactly. One JSON record per game is appended
+to the output file as soon as the game is over.
+
+    python tournament.py --players montecarlo random --games 1000 --workers 32 --out results.jsonl
+'''
+import argparse
+import inspect
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import combinations
+
+import numpy as np
+
+from game import Game
+from observers import LatencyHistogram
+from records import GameRecordWriter, MoveRecorder
+from players.randomPlayer import RandomPlayer
+from players.myPlayer import MyPlayer
+from players.minmaxPlayer import MinMaxPlayer
+from players.montecarloPlayer import MonteCarloPlayer
+from players.qlearningPlayer import LinearQLearningPlayer, QLearningPlayer
+
+PLAYERS = {
+    'random': RandomPlayer,
+    'my': MyPlayer,
+    'minmax': MinMaxPlayer,
+    'montecarlo': MonteCarloPlayer,
+    'qlearning': QLearningPlayer,
+    'qlinear': LinearQLearningPlayer,
+}
+
+# a game without a winner after this many turns is a draw
+MAX_TURNS = 1000
+
+
+def _entrant(entrant) -> tuple[str, type, dict]:
+    '''Returns (name, class, kwargs) of a roster entry'''
+    if isinstance(entrant, tuple):
+        name, cls, kwargs = entrant
+        return name, cls, dict(kwargs)
+    return entrant.__name__, entrant, {}
+
+
+def _make_player(cls: type, kwargs: dict, seat: int, seed: int):
+    '''Builds the player, passing the seat and the seed to the classes which accept them'''
+    parameters = inspect.signature(cls.__init__).parameters
+    kwargs = dict(kwargs)
+    if 'player' in parameters and 'player' not in kwargs:
+        kwargs['player'] = seat
+    if 'seed' in parameters and 'seed' not in kwargs:
+        kwargs['seed'] = seed
+    return cls(**kwargs)
+
+
+def _play_game(task: dict) -> dict:
+    '''Plays one game in a worker process, returns its record'''
+    seed = task['seed']
+    # players which use the global generators are reproducible too
+    random.seed(seed)
+    np.random.seed(seed % (1 << 32))
+    players = [_make_player(cls, kwargs, seat, seed + seat) for seat, (_, cls, kwargs) in enumerate(task['entrants'])]
+    game = Game(showPrint=False)
+    histogram = LatencyHistogram() if task.get('latency') else None
+    recorder = MoveRecorder() if task.get('record_moves') else None
+    observers = [observer for observer in (histogram, recorder) if observer is not None]
+    start = time.perf_counter()
+    winner = game.play(players[0], players[1], max_turns=task['max_turns'], observers=observers)
+    elapsed = time.perf_counter() - start
+    for player in players:
+        if hasattr(player, 'close'):
+            player.close()
+    record = {
+        'game': task['game'],
+        'seed': seed,
+        'player0': task['entrants'][0][0],
+        'player1': task['entrants'][1][0],
+        'winner': int(winner),
+        'moves': game.num_playes,
+        'time': elapsed,
+    }
+    if histogram is not None:
+        # time of the decisions and rejected attempts of each seat, see observers.py
+        for seat, s in histogram.summary().items():
+            record[f'latency{seat}'] = {key: s[key] for key in ('mean', 'p90', 'max', 'rejected')}
+    if recorder is not None:
+        # written to the game records by run, not to the JSON records
+        record['move_ids'] = recorder.moves
+    return record
+
+
+def schedule(roster: list, games_per_pair: int, mode: str = 'round-robin', seed: int = 0, max_turns: int = MAX_TURNS) -> list[dict]:
+    '''
+    Returns the games to play. 'round-robin' pairs every entrant with every other,
+    'gauntlet' pairs the first entrant with each of the others. Seats alternate game by game
+    '''
+    entrants = [_entrant(e) for e in roster]
+    if mode == 'round-robin':
+        pairs = list(combinations(entrants, 2))
+    elif mode == 'gauntlet':
+        pairs = [(entrants[0], other) for other in entrants[1:]]
+    else:
+        raise ValueError(f"unknown mode {mode!r}, expected 'round-robin' or 'gauntlet'")
+    seeds = np.random.SeedSequence(seed).generate_state(len(pairs) * games_per_pair, dtype=np.uint64)
+    tasks = []
+    for a, b in pairs:
+        for i in range(games_per_pair):
+            index = len(tasks)
+            tasks.append({
+                'game': index,
+                'seed': int(seeds[index] >> np.uint64(1)),
+                'entrants': (a, b) if i % 2 == 0 else (b, a),
+                'max_turns': max_turns,
+            })
+    return tasks
+
+
+def run(roster: list, games_per_pair: int, mode: str = 'round-robin', workers: int | None = None, out: str | None = None,
+        seed: int = 0, max_turns: int = MAX_TURNS, progress: bool = True, latency: bool = False,
+        records_dir: str | None = None) -> list[dict]:
+    '''
+    Plays the tournament, appending the records to out (JSON lines) as the games end. Returns the records.
+    With latency every record also holds the decision times of each seat (latency0, latency1).
+    With records_dir the moves of the games are appended to the binary game records there, see records.py
+    '''
+    tasks = schedule(roster, games_per_pair, mode, seed, max_turns)
+    for task in tasks:
+        task['latency'] = latency
+        task['record_moves'] = records_dir is not None
+    records = []
+    f = open(out, 'a') if out is not None else None
+    writer = GameRecordWriter(records_dir) if records_dir is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_play_game, task) for task in tasks]
+            iterator = as_completed(futures)
+            if progress:
+                from tqdm import tqdm
+                iterator = tqdm(iterator, total=len(futures))
+            for future in iterator:
+                record = future.result()
+                if writer is not None:
+                    writer.append(record.pop('move_ids'), record['winner'], record['seed'])
+                records.append(record)
+                if f is not None:
+                    f.write(json.dumps(record) + '\n')
+                    f.flush()
+    finally:
+        if f is not None:
+            f.close()
+        if writer is not None:
+            writer.close()
+    records.sort(key=lambda r: r['game'])
+    return records
+
+
+def load(path: str) -> list[dict]:
+    '''Reads the records written by run'''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def wilson_interval(score: float, n: int, z: float = 1.96) -> tuple[float, float]:
+    '''Wilson confidence interval of a rate observed on n games (95% with the default z)'''
+    if n == 0:
+        return 0.0, 1.0
+    center = (score + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(score * (1 - score) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def elo_ratings(records: list[dict], iterations: int = 200, prior_games: float = 1.0) -> dict[str, float]:
+    '''
+    Elo ratings (mean 1500) fitted to the results with the Bradley-Terry model, draws count half a win.
+    Every pair which met gets prior_games virtual draws, so that an unbeaten player has a finite rating
+    '''
+    names = sorted({r['player0'] for r in records} | {r['player1'] for r in records})
+    wins = {name: 0.0 for name in names}
+    games = {}
+    for r in records:
+        pair = tuple(sorted((r['player0'], r['player1'])))
+        games[pair] = games.get(pair, 0) + 1
+        if r['winner'] == -1:
+            wins[r['player0']] += 0.5
+            wins[r['player1']] += 0.5
+        else:
+            wins[r['player' + str(r['winner'])]] += 1
+    for pair in games:
+        games[pair] += prior_games
+        for name in pair:
+            wins[name] += prior_games / 2
+    # minorization-maximization updates of the strengths
+    strength = {name: 1.0 for name in names}
+    for _ in range(iterations):
+        updated = {}
+        for name in names:
+            denominator = sum(n / (strength[a] + strength[b]) for (a, b), n in games.items() if name in (a, b))
+            updated[name] = wins[name] / denominator if denominator else strength[name]
+        mean_log = sum(math.log(s) for s in updated.values()) / len(names)
+        strength = {name: s / math.exp(mean_log) for name, s in updated.items()}
+    return {name: 1500 + 400 * math.log10(strength[name]) for name in names}
+
+
+def summary(records: list[dict]) -> dict[str, dict]:
+    '''Per player: games, wins, losses, draws, score rate with its 95% confidence interval and Elo'''
+    stats = {}
+    for r in records:
+        for seat in (0, 1):
+            s = stats.setdefault(r['player' + str(seat)], {'games': 0, 'wins': 0, 'losses': 0, 'draws': 0})
+            s['games'] += 1
+            if r['winner'] == -1:
+                s['draws'] += 1
+            elif r['winner'] == seat:
+                s['wins'] += 1
+            else:
+                s['losses'] += 1
+    elo = elo_ratings(records) if records else {}
+    for name, s in stats.items():
+        s['score'] = (s['wins'] + 0.5 * s['draws']) / s['games']
+        s['ci95'] = wilson_interval(s['score'], s['games'])
+        s['elo'] = elo[name]
+    return stats
+
+
+def print_summary(records: list[dict]) -> None:
+    print("\nResult:")
+    for name, s in sorted(summary(records).items(), key=lambda item: -item[1]['elo']):
+        low, high = s['ci95']
+        print("\t{:<20} games {:5d}  W/D/L {:5d}/{:5d}/{:5d}  score {:6.2f}% [{:6.2f}%, {:6.2f}%]  Elo {:7.1f}".format(
+            name, s['games'], s['wins'], s['draws'], s['losses'], s['score'] * 100, low * 100, high * 100, s['elo']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a tournament between Quixo players')
+    parser.add_argument('--players', nargs='+', choices=sorted(PLAYERS), required=True)
+    parser.add_argument('--games', type=int, default=100, help='games for each pair of players')
+    parser.add_argument('--mode', choices=['round-robin', 'gauntlet'], default='round-robin')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=None, help='JSON lines file where the records are appended')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', action='store_true', help='record the decision times of the players')
+    parser.add_argument('--records', default=None, help='directory where the moves of the games are recorded')
+    args = parser.parse_args()
+
+    roster = [(name, PLAYERS[name], {}) for name in args.players]
+    print_summary(run(roster, args.games, args.mode, args.workers, args.out, args.seed, latency=args.latency,
+                      records_dir=args.records))
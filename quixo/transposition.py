@@ -0,0 +1,286 @@
+'''
+Transposition table for the search players.
+
+Positions are identified by Zobrist hashes which are updated incrementally by the search after
+every move. The hash of a position is computed for all the 8 symmetries of the board at once,
+so that a position and its rotations/reflections share the same table entry.
+SharedTranspositionTable keeps the entries in shared memory, for the processes of a parallel search.
+'''
+import random
+import struct
+from multiprocessing import shared_memory
+
+import bitboard
+
+# bound type of the stored scores
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+class Zobrist:
+    '''
+    Zobrist keys of a position under the 8 symmetries of the board, packed in a single int:
+    bits [64 * s, 64 * s + 64) hold the hash of the position transformed by symmetry s
+    (see bitboard.CELL_SYMMETRIES). Packing them makes an update cost as much as for one hash.
+    '''
+
+    def __init__(self, seed: int = 0) -> None:
+        rng = random.Random(seed)
+        cells = bitboard.SIZE * bitboard.SIZE
+        cell_keys = [[rng.getrandbits(_HASH_BITS) for _ in range(cells)] for _ in range(2)]
+        # packed key of a cell: in slice s the key of the cell where s sends it
+        packed = [
+            [
+                sum(cell_keys[p][bitboard.CELL_SYMMETRIES[s][i]] << (_HASH_BITS * s) for s in range(bitboard.NUM_SYMMETRIES))
+                for i in range(cells)
+            ]
+            for p in range(2)
+        ]
+        # _row_keys[player][row][bits] -> xor of the packed keys of the cells set in the 5 bits of the row
+        self._row_keys = [
+            [[self._xor(packed[p][r * bitboard.SIZE + c] for c in range(bitboard.SIZE) if bits >> c & 1) for bits in range(32)]
+             for r in range(bitboard.SIZE)]
+            for p in range(2)
+        ]
+        # the player to move does not change under the symmetries
+        side = rng.getrandbits(_HASH_BITS)
+        self.side_key = sum(side << (_HASH_BITS * s) for s in range(bitboard.NUM_SYMMETRIES))
+
+    @staticmethod
+    def _xor(keys) -> int:
+        result = 0
+        for key in keys:
+            result ^= key
+        return result
+
+    def _rows_hash(self, b0: int, b1: int, rows) -> int:
+        keys0, keys1 = self._row_keys
+        result = 0
+        for r in rows:
+            shift = r * bitboard.SIZE
+            result ^= keys0[r][b0 >> shift & 31] ^ keys1[r][b1 >> shift & 31]
+        return result
+
+    def hash(self, bitboards: tuple[int, int], player_id: int) -> int:
+        '''Returns the packed hash of the position with player_id to move'''
+        key = self._rows_hash(bitboards[0], bitboards[1], range(bitboard.SIZE))
+        return key ^ self.side_key if player_id else key
+
+    def update(self, key: int, old: tuple[int, int], new: tuple[int, int], move_id: int) -> int:
+        '''Returns the packed hash after move_id turned old into new and passed the turn'''
+        # only the cells that changed are xored, and they all lie in the rows touched by the move
+        changes = self._rows_hash(old[0] ^ new[0], old[1] ^ new[1], _MOVE_ROWS[move_id])
+        return key ^ changes ^ self.side_key
+
+    @staticmethod
+    def canonical(key: int) -> tuple[int, int]:
+        '''
+        Returns (hash, symmetry): the smallest of the 8 hashes, shared by all the symmetric positions,
+        and the symmetry which transforms the position into the one it belongs to
+        '''
+        best, best_symmetry = key & _HASH_MASK, 0
+        for s in range(1, bitboard.NUM_SYMMETRIES):
+            h = key >> (_HASH_BITS * s) & _HASH_MASK
+            if h < best:
+                best, best_symmetry = h, s
+        return best, best_symmetry
+
+
+# rows which contain the cells moved by each move
+_MOVE_ROWS = [
+    tuple(r for r in range(bitboard.SIZE) if (~keep & bitboard.FULL) & bitboard.ROW_MASKS[r])
+    for keep, _, _, _, _ in bitboard.MOVE_SPECS
+]
+
+
+class TranspositionTable:
+    '''
+    Fixed-size table of search results. A canonical hash is stored in slot hash % size, a slot
+    keeps (hash, depth, bound, score, move, generation). The moves are stored in the frame of the
+    canonical position, see Zobrist.canonical.
+
+    policy decides what happens when a slot is already used:
+    - 'depth': keep the entry searched deeper, unless it was stored by an older search
+    - 'always': always replace it with the newest entry
+    '''
+
+    POLICIES = ('depth', 'always')
+
+    def __init__(self, size: int = 1 << 16, policy: str = 'depth') -> None:
+        if size <= 0:
+            raise ValueError(f'size must be positive, got {size}')
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown replacement policy {policy!r}, expected one of {self.POLICIES}')
+        self.size = size
+        self.policy = policy
+        self._slots = [None] * size
+        self.generation = 0
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self) -> None:
+        '''Marks the entries stored so far as old, so that the 'depth' policy can replace them'''
+        self.generation += 1
+
+    def probe(self, key: int) -> tuple[int, int, float, int] | None:
+        '''Returns (depth, bound, score, move) stored for the canonical hash, None if it is not stored'''
+        entry = self._slots[key % self.size]
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] != key:
+            # the slot holds a different position
+            self.collisions += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1:5]
+
+    def store(self, key: int, depth: int, bound: int, score: float, move: int) -> None:
+        '''Stores a search result for the canonical hash, according to the replacement policy'''
+        index = key % self.size
+        entry = self._slots[index]
+        if entry is None:
+            self.used += 1
+        elif self.policy == 'depth' and entry[0] != key and entry[5] == self.generation and entry[1] > depth:
+            return
+        else:
+            self.overwrites += 1
+        self.stores += 1
+        self._slots[index] = (key, depth, bound, score, move, self.generation)
+
+    def clear(self) -> None:
+        '''Removes all the entries and resets the counters'''
+        self.__init__(self.size, self.policy)
+
+    def stats(self) -> dict:
+        '''Returns the counters of the table'''
+        probes = self.hits + self.misses
+        return {
+            'size': self.size,
+            'used': self.used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'collisions': self.collisions,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'hit_rate': self.hits / probes if probes else 0.0,
+        }
+
+
+# words of the shared table before the slots: the generation
+_HEADER_WORDS = 1
+_SLOT_WORDS = 3
+_DOUBLE = struct.Struct('<d')
+_WORD = struct.Struct('<Q')
+# layout of the data word of a shared slot
+_BOUND_SHIFT = 8
+_MOVE_SHIFT = 10
+_GENERATION_SHIFT = 16
+_USED = 1 << 24
+
+
+class SharedTranspositionTable:
+    '''
+    TranspositionTable in shared memory (multiprocessing.shared_memory), probed and stored by all the
+    processes of a parallel search, see lazy_smp.py. Same interface and replacement policies.
+
+    There are no locks: a slot is three 64-bit words (key ^ data ^ score, data, score), data packing
+    depth, bound, move and generation. A slot torn by two processes writing at once no longer
+    matches its key and reads as empty. The table is created by the process which passes no name;
+    the other processes attach to it with its name. The counters are those of this process
+    '''
+
+    POLICIES = TranspositionTable.POLICIES
+
+    def __init__(self, size: int = 1 << 16, policy: str = 'depth', name: str | None = None) -> None:
+        if size <= 0:
+            raise ValueError(f'size must be positive, got {size}')
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown replacement policy {policy!r}, expected one of {self.POLICIES}')
+        self.size = size
+        self.policy = policy
+        self._owner = name is None
+        if self._owner:
+            self._memory = shared_memory.SharedMemory(create=True, size=8 * (_HEADER_WORDS + _SLOT_WORDS * size))
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+        self.name = self._memory.name
+        self._words = self._memory.buf.cast('Q')
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    @property
+    def generation(self) -> int:
+        return self._words[0]
+
+    def new_search(self) -> None:
+        '''Marks the entries stored so far as old, for all the processes'''
+        self._words[0] = (self._words[0] + 1) & 255
+
+    def probe(self, key: int) -> tuple[int, int, float, int] | None:
+        '''Returns (depth, bound, score, move) stored for the canonical hash, None if it is not stored'''
+        words = self._words
+        base = _HEADER_WORDS + _SLOT_WORDS * (key % self.size)
+        check, data, score = words[base], words[base + 1], words[base + 2]
+        if not data & _USED:
+            self.misses += 1
+            return None
+        if check ^ data ^ score != key:
+            # a different position, or a slot being written
+            self.collisions += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data & 255, data >> _BOUND_SHIFT & 3, _DOUBLE.unpack(_WORD.pack(score))[0], data >> _MOVE_SHIFT & 63
+
+    def store(self, key: int, depth: int, bound: int, score: float, move: int) -> None:
+        '''Stores a search result for the canonical hash, according to the replacement policy'''
+        words = self._words
+        base = _HEADER_WORDS + _SLOT_WORDS * (key % self.size)
+        old = words[base + 1]
+        generation = words[0]
+        if not old & _USED:
+            self.used += 1
+        elif (self.policy == 'depth' and words[base] ^ old ^ words[base + 2] != key
+              and old >> _GENERATION_SHIFT & 255 == generation and old & 255 > depth):
+            return
+        else:
+            self.overwrites += 1
+        self.stores += 1
+        data = _USED | generation << _GENERATION_SHIFT | (move & 63) << _MOVE_SHIFT | bound << _BOUND_SHIFT | min(depth, 255)
+        score_bits = _WORD.unpack(_DOUBLE.pack(score))[0]
+        words[base + 1] = data
+        words[base + 2] = score_bits
+        words[base] = key ^ data ^ score_bits
+
+    def clear(self) -> None:
+        '''Removes all the entries, for all the processes, and resets the counters of this process'''
+        self._memory.buf[8 * _HEADER_WORDS:] = bytes(8 * _SLOT_WORDS * self.size)
+        self.used = self.hits = self.misses = self.collisions = self.stores = self.overwrites = 0
+
+    def stats(self) -> dict:
+        '''Returns the counters of this process'''
+        return TranspositionTable.stats(self)
+
+    def close(self) -> None:
+        '''Detaches from the shared memory, and releases it if this process created the table'''
+        if self._words is None:
+            return
+        self._words.release()
+        self._words = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
@@ -0,0 +1,125 @@
+'''
+Vectorized Quixo environment: N games advanced together, one ply per step.
+
+The games are stored as arrays of bitboards (see bitboard.py) and stepped with the batched
+operations of rollout.py, so an agent chooses the moves of all the games with one call on the
+(N, 44) mask of the legal moves. A finished game is reset automatically: the step returns its
+final result and the observation of the new game.
+
+    env = VecQuixoEnv(1024, seed=0)
+    observations = env.reset()
+    while ...:
+        actions = agent(observations, env.legal_mask())
+        observations, rewards, dones, info = env.step(actions)
+
+Run it to measure the plies per second with random agents:
+    python vec_env.py --envs 1 64 1024 8192
+'''
+import argparse
+import time
+
+import numpy as np
+
+import bitboard
+import rollout
+
+# cell index of the rows and columns of the observations
+_CELL_BITS = np.arange(bitboard.SIZE * bitboard.SIZE, dtype=np.int64)
+
+
+class VecQuixoEnv:
+    def __init__(self, num_envs: int, max_plies: int = 1000, auto_reset: bool = True, seed: int | None = None) -> None:
+        '''
+        A game without a winner after max_plies plies is a draw. Without auto_reset the finished
+        games stay as they are (and take no more steps) until reset is called
+        '''
+        if num_envs <= 0:
+            raise ValueError(f'num_envs must be positive, got {num_envs}')
+        self.num_envs = num_envs
+        self.max_plies = max_plies
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+        self.b0 = np.zeros(num_envs, dtype=np.int64)
+        self.b1 = np.zeros(num_envs, dtype=np.int64)
+        # player to move and plies played in each game
+        self.player = np.zeros(num_envs, dtype=np.int64)
+        self.plies = np.zeros(num_envs, dtype=np.int64)
+        self.done = np.zeros(num_envs, dtype=bool)
+
+    def reset(self, indices: np.ndarray | None = None) -> np.ndarray:
+        '''Starts new games (all of them, or the ones at indices) on the empty board, player 0 to move. Returns the observations'''
+        if indices is None:
+            indices = slice(None)
+        self.b0[indices] = 0
+        self.b1[indices] = 0
+        self.player[indices] = 0
+        self.plies[indices] = 0
+        self.done[indices] = False
+        return self.observations()
+
+    def observations(self) -> np.ndarray:
+        '''Returns the (N, 5, 5) boards, with the values of Game.get_board: -1 empty, 0 and 1 the players'''
+        cells0 = (self.b0[:, None] >> _CELL_BITS) & 1
+        cells1 = (self.b1[:, None] >> _CELL_BITS) & 1
+        board = cells1 - (1 - cells0 - cells1)
+        return board.astype(np.int16).reshape(self.num_envs, bitboard.SIZE, bitboard.SIZE)
+
+    def legal_mask(self) -> np.ndarray:
+        '''Returns the (N, 44) boolean mask of the move ids the player to move can perform in each game'''
+        return rollout.legal_mask(self.b0, self.b1, self.player)
+
+    def random_actions(self) -> np.ndarray:
+        '''Returns a uniformly random legal move id for each game'''
+        keys = self.rng.random((self.num_envs, bitboard.NUM_MOVES))
+        keys[~self.legal_mask()] = -1.0
+        return keys.argmax(axis=1)
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+        '''
+        Plays the move id of each game for its player to move. Returns (observations, rewards, dones, info):
+        the reward is +1 if the move won the game for the player who made it, -1 if it made the opponent
+        win (see bitboard.winner), 0 otherwise. info['winner'] holds the winner of the games which ended
+        with this step (-1 for draws and for the games still running), info['plies'] their length.
+        With auto_reset the observations of the games which ended are the ones of their new game
+        '''
+        actions = np.asarray(actions, dtype=np.intp)
+        if actions.shape != (self.num_envs,):
+            raise ValueError(f'expected {self.num_envs} actions, got shape {actions.shape}')
+        active = ~self.done
+        legal = self.legal_mask()[np.arange(self.num_envs), actions]
+        if not legal[active].all():
+            raise ValueError(f'illegal moves in games {np.flatnonzero(active & ~legal).tolist()}')
+
+        mover = self.player
+        b0, b1 = rollout.apply_moves(self.b0, self.b1, mover, actions)
+        self.b0 = np.where(active, b0, self.b0)
+        self.b1 = np.where(active, b1, self.b1)
+        self.plies += active
+        self.player = np.where(active, 1 - mover, mover)
+
+        winner = np.where(active, rollout.winners(self.b0, self.b1, self.player), -1)
+        rewards = np.where(winner == -1, 0, np.where(winner == mover, 1, -1)).astype(np.float32)
+        dones = active & ((winner != -1) | (self.plies >= self.max_plies))
+        info = {'winner': winner, 'plies': np.where(dones, self.plies, 0)}
+        self.done |= dones
+        if self.auto_reset and dones.any():
+            self.reset(dones)
+        return self.observations(), rewards, dones, info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Plies per second of random games in the vectorized environment')
+    parser.add_argument('--envs', type=int, nargs='+', default=[1, 64, 1024, 8192])
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    for n in args.envs:
+        env = VecQuixoEnv(n, seed=0)
+        env.reset()
+        games = 0
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            _, _, dones, _ = env.step(env.random_actions())
+            games += int(dones.sum())
+        elapsed = time.perf_counter() - start
+        print(f"envs={n:6d}  plies/s={n * args.steps / elapsed:12.0f}  games/s={games / elapsed:10.0f}")
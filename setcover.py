@@ -0,0 +1,179 @@
+'''
+Local search for the set covering problem of the Halloween challenge.
+
+A solution selects some of the sets (rows of the problem); it is valid when every item (column)
+is covered. Instead of OR-reducing the selected rows at every evaluation, CoverState keeps how
+many selected sets cover each item and how many items are uncovered: flipping a set updates
+them in O(|set|). The effect of many candidate flips is evaluated at once from the CSR rows of
+the candidates:
+
+    items covered by a candidate which no selected set covers    rows @ (counts == 0)
+    items covered by a candidate and by one selected set          rows @ (counts == 1)
+
+the first are gained if the candidate is selected, the second lost if it is removed. A few
+candidates are gathered directly from the CSR arrays, larger batches use the sparse products.
+
+Solutions are compared as (valid, -cost), like fitness1 in Halloween.ipynb; the searches use the
+scalar score -(uncovered * (num_sets + 1) + cost), which orders solutions the same way and also
+ranks the invalid ones by how many items they leave uncovered.
+
+    python setcover.py --points 5000 --density .3 --steps 10000 --batch 64
+'''
+import argparse
+import math
+import time
+
+import numpy as np
+from scipy import sparse
+
+# up to this many candidates the rows are gathered with NumPy instead of indexing the sparse array
+_GATHER_MAX = 16
+
+
+class CoverState:
+    def __init__(self, sets, selected=None) -> None:
+        '''sets: (num_sets, num_points) boolean array, dense or sparse. selected: the sets selected at the start, none by default'''
+        self.sets = sparse.csr_array(sets, dtype=np.int32)
+        self.sets.sum_duplicates()
+        self.sets.eliminate_zeros()
+        self.sets.data[:] = 1
+        self.num_sets, self.num_points = self.sets.shape
+        self._indptr, self._indices = self.sets.indptr, self.sets.indices
+        # an uncovered item costs more than selecting every set
+        self.penalty = self.num_sets + 1
+        self.selected = np.zeros(self.num_sets, dtype=bool)
+        # counts[item] -> selected sets covering the item
+        self.counts = np.zeros(self.num_points, dtype=np.int32)
+        self.uncovered = self.num_points
+        self.cost = 0
+        # flips evaluated, the measure of the challenge
+        self.evaluations = 0
+        if selected is not None:
+            for i in np.flatnonzero(selected):
+                self.flip(i)
+
+    def items(self, i: int) -> np.ndarray:
+        '''Returns the items covered by set i'''
+        return self._indices[self._indptr[i]:self._indptr[i + 1]]
+
+    def flip(self, i: int) -> None:
+        '''Selects set i if it is not selected, otherwise removes it'''
+        items = self.items(i)
+        counts = self.counts
+        if self.selected[i]:
+            counts[items] -= 1
+            self.uncovered += int(np.count_nonzero(counts[items] == 0))
+            self.cost -= 1
+        else:
+            self.uncovered -= int(np.count_nonzero(counts[items] == 0))
+            counts[items] += 1
+            self.cost += 1
+        self.selected[i] = not self.selected[i]
+
+    def fitness(self) -> tuple[bool, int]:
+        '''Returns (valid, -cost), as fitness1'''
+        return self.uncovered == 0, -self.cost
+
+    def score(self) -> int:
+        return -(self.uncovered * self.penalty + self.cost)
+
+    def flip_deltas(self, candidates) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns the changes of the uncovered items and of the cost if each candidate set were flipped,
+        alone, in the current solution. The solution is not changed
+        '''
+        candidates = np.asarray(candidates, dtype=np.intp)
+        self.evaluations += len(candidates)
+        zero, one = self.counts == 0, self.counts == 1
+        if len(candidates) > _GATHER_MAX:
+            # sparse products of the rows of the candidates
+            rows = self.sets[candidates]
+            gained = rows @ zero.astype(np.int32)
+            lost = rows @ one.astype(np.int32)
+        else:
+            # few rows: gathered by hand, scipy's indexing costs more than the work
+            starts = self._indptr[candidates]
+            lengths = self._indptr[candidates + 1] - starts
+            owner = np.repeat(np.arange(len(candidates)), lengths)
+            items = self._indices[np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths - starts, lengths)]
+            gained = np.bincount(owner, weights=zero[items], minlength=len(candidates)).astype(np.int64)
+            lost = np.bincount(owner, weights=one[items], minlength=len(candidates)).astype(np.int64)
+        selected = self.selected[candidates]
+        return np.where(selected, lost, -gained), np.where(selected, -1, 1)
+
+    def flip_scores(self, candidates) -> np.ndarray:
+        '''Returns the score of the solution after flipping each candidate, see flip_deltas'''
+        d_uncovered, d_cost = self.flip_deltas(candidates)
+        return -((self.uncovered + d_uncovered) * self.penalty + self.cost + d_cost)
+
+
+def hill_climbing(sets, steps: int = 1000, batch: int = 1, rng: np.random.Generator | None = None,
+                  selected=None) -> CoverState:
+    '''
+    Every step draws batch random sets and flips the best one, if the solution does not get worse.
+    With batch 1 it is the hill climbing of the notebook (tweak flips one random set)
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    state = CoverState(sets, selected)
+    for _ in range(steps):
+        candidates = rng.integers(0, state.num_sets, batch)
+        scores = state.flip_scores(candidates)
+        best = int(scores.argmax())
+        if scores[best] >= state.score():
+            state.flip(candidates[best])
+    return state
+
+
+def simulated_annealing(sets, steps: int = 10_000, temperature: float = 15, schedule: int = 2, batch: int = 1,
+                        rng: np.random.Generator | None = None, selected=None) -> CoverState:
+    '''
+    Every step draws batch random sets and flips the best one if it does not make the solution worse,
+    otherwise with probability exp(-loss / t). t starts at temperature and drops by 1 every schedule
+    steps, down to 1, as in the notebook. Returns the state of the best solution found
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    state = CoverState(sets, selected)
+    best_score, best_selected = state.score(), state.selected.copy()
+    t = temperature
+    for step in range(steps):
+        if step % schedule == 0 and t > 1:
+            t -= 1
+        candidates = rng.integers(0, state.num_sets, batch)
+        scores = state.flip_scores(candidates)
+        best = int(scores.argmax())
+        loss = state.score() - scores[best]
+        if loss <= 0 or rng.random() < math.exp(-loss / t):
+            state.flip(candidates[best])
+            if state.score() > best_score:
+                best_score, best_selected = state.score(), state.selected.copy()
+    if state.score() < best_score:
+        evaluations = state.evaluations
+        state = CoverState(sets, best_selected)
+        state.evaluations = evaluations
+    return state
+
+
+def random_problem(num_points: int, num_sets: int, density: float, rng: np.random.Generator | None = None) -> sparse.csr_array:
+    '''Random problem like make_set_covering_problem of the notebook, every item is covered by at least one set'''
+    rng = rng if rng is not None else np.random.default_rng()
+    sets = rng.random((num_sets, num_points)) < density
+    sets[rng.integers(0, num_sets, num_points), np.arange(num_points)] = True
+    return sparse.csr_array(sets)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated annealing on a random set covering problem')
+    parser.add_argument('--points', type=int, default=1000, help='items, and sets')
+    parser.add_argument('--density', type=float, default=.3)
+    parser.add_argument('--steps', type=int, default=10_000)
+    parser.add_argument('--batch', type=int, default=1, help='candidate flips evaluated per step')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sets = random_problem(args.points, args.points, args.density, rng)
+    start = time.perf_counter()
+    state = simulated_annealing(sets, args.steps, batch=args.batch, rng=rng)
+    elapsed = time.perf_counter() - start
+    print(f"fitness={state.fitness()}  evaluations={state.evaluations}  time={elapsed:.2f} s  "
+          f"steps/s={args.steps / elapsed:.0f}")